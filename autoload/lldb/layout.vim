@@ -50,6 +50,7 @@ function! lldb#layout#init_buffers()
     let bnr = bufnr('[lldb]' . bname, 1)
     call setbufvar(bnr, '&ft', 'lldb')
     call setbufvar(bnr, '&bt', 'nofile')
+    call setbufvar(bnr, '&bh', 'hide')
     call setbufvar(bnr, '&swf', 0)
     call setbufvar(bnr, '&ma', 0)
     call setbufvar(bnr, '&bl', 0)
@@ -59,6 +60,75 @@ function! lldb#layout#init_buffers()
   return s:buffer_map
 endfun
 
+" Returns a dictionary that maps names of lldb buffers shown in the current tab
+" to the height of the tallest window showing each.
+function! lldb#layout#visible_buffers()
+  let visible = {}
+  if !exists('s:buffer_map')
+    return visible
+  endif
+  for [bname, bnr] in items(s:buffer_map)
+    for wnr in range(1, winnr('$'))
+      if winbufnr(wnr) == bnr
+        let visible[bname] = max([get(visible, bname, 0), winheight(wnr)])
+      endif
+    endfor
+  endfor
+  return visible
+endfun
+
+" Notifies the remote plugin that lldb buffers were shown, so that the stale
+" ones get refreshed. If a buffer number is given, only that buffer is
+" considered. Notifications are deferred, and sent together.
+let s:shown_pending = {}
+function! lldb#layout#shown(...)
+  let visible = lldb#layout#visible_buffers()
+  if a:0 > 0
+    call filter(visible, 's:buffer_map[v:key] == a:1')
+  endif
+  if empty(visible)
+    return
+  endif
+  if empty(s:shown_pending)
+    call timer_start(0, function('s:shown_notify'))
+  endif
+  call extend(s:shown_pending, visible)
+endfun
+
+function! s:shown_notify(timer)
+  let visible = s:shown_pending
+  let s:shown_pending = {}
+  call lldb#remote#__notify('shown', visible)
+endfun
+
+" Returns [full path, first line, last line] for each window showing a file, in
+" any tab, but those showing buffer a:1 (if given). Without the WinScrolled event
+" to follow scrolled windows, whole files are given (with last line 0).
+function! lldb#layout#shown_files(...)
+  let except = get(a:000, 0, -1)
+  let scrolled = exists('##WinScrolled')
+  let files = []
+  for win in getwininfo()
+    if win.bufnr != except && getbufvar(win.bufnr, '&buftype') == ''
+          \ && bufname(win.bufnr) != ''
+      call add(files, [fnamemodify(bufname(win.bufnr), ':p'),
+            \ scrolled ? win.topline : 1, scrolled ? win.botline : 0])
+    endif
+  endfor
+  return files
+endfun
+
+" Notifies the remote plugin of the lines of files shown in windows, once a file
+" was shown, scrolled, or is no longer shown in any window, if breakpoint signs
+" are only placed on shown lines.
+function! lldb#layout#file_shown(bnr, shown)
+  if !get(g:, 'lldb#sign#visible_only', 0) || getbufvar(a:bnr, '&buftype') != ''
+        \ || bufname(a:bnr) == ''
+    return
+  endif
+  call lldb#remote#__notify('fileshown', lldb#layout#shown_files(a:shown ? -1 : a:bnr))
+endfun
+
 function! lldb#layout#init_window(width, split, bnr)
   exe 'belowright ' . a:width . a:split . '+b' . a:bnr
   set nonu
@@ -79,6 +149,10 @@ function! lldb#layout#init_window(width, split, bnr)
   elseif s:buffer_map['breakpoints'] == a:bnr
     nnoremap <silent> <buffer> <nowait> x
             \ :call lldb#remote#__notify("breakdelete", lldb#layout#breakpoint_retrieve())<CR>
+  elseif s:buffer_map['locals'] == a:bnr
+    nnoremap <silent> <buffer> <CR> :call lldb#remote#__notify("toggle", "locals", line('.'))<CR>
+  elseif s:buffer_map['registers'] == a:bnr
+    nnoremap <silent> <buffer> <CR> :call lldb#remote#__notify("toggle", "registers", line('.'))<CR>
   endif
 endfun
 
@@ -9,6 +9,14 @@ endfun
 function! lldb#remote#init(chan_id)
   let g:lldb#_channel_id = a:chan_id
   au VimLeavePre * call lldb#remote#__notify('exit')
+  au BufWinEnter * call lldb#layout#shown(+expand('<abuf>'))
+  au TabEnter * call lldb#layout#shown()
+  au BufWinEnter * call lldb#layout#file_shown(+expand('<abuf>'), 1)
+  au BufWinLeave * call lldb#layout#file_shown(+expand('<abuf>'), 0)
+  if exists('##WinScrolled')
+    au WinScrolled * call lldb#layout#file_shown(+expand('<abuf>'), 1)
+  endif
+  au BufDelete,BufWipeout * call lldb#remote#__notify('bufdelete', +expand('<abuf>'))
   call lldb#remote#define_commands()
 endfun
 
@@ -55,6 +63,7 @@ endfun
 
 function! lldb#remote#define_commands()
   command!  LLrefresh   call lldb#remote#__notify("refresh")
+  command!  LLcancel    call lldb#remote#__notify("cancel")
   command!      -nargs=1    -complete=customlist,lldb#session#complete
           \ LLmode      call lldb#remote#__notify("mode", <f-args>)
   command!      -nargs=*    -complete=customlist,<SID>llcomplete
@@ -63,7 +72,7 @@ function! lldb#remote#define_commands()
           \ LLstdin     call lldb#remote#stdin_prompt(<f-args>)
 
   nnoremap <silent> <Plug>LLBreakSwitch
-          \ :call lldb#remote#__notify("breakswitch", bufnr("%"), getcurpos()[1])<CR>
+          \ :call lldb#remote#__notify("breakswitch", expand("%:p"), getcurpos()[1])<CR>
   vnoremap <silent> <Plug>LLStdInSelected
           \ :<C-U>call lldb#remote#__notify("stdin", lldb#util#get_selection())<CR>
 endfun
@@ -8,12 +8,40 @@ function! lldb#util#get_selection()
   return join(lines, "\n")
 endfun
 
-function! lldb#util#buffer_do(bufnr, cmd)
-  let old_wnr = winnr()
-  for wnr in range(1, winnr('$') + 1)
-    if winbufnr(wnr) == a:bufnr
-      exe wnr . "windo " . a:cmd
-    endif
+" Creates listed buffers with the given names (if they don't exist), and
+" returns the list of their numbers.
+function! lldb#util#buffers_add(names)
+  let bufnrs = []
+  for name in a:names
+    let bnr = bufnr(name, 1)
+    call setbufvar(bnr, '&bl', 1)
+    call add(bufnrs, bnr)
+  endfor
+  return bufnrs
+endfun
+
+" Appends lines to a (nomodifiable) buffer, joining the first one to its last
+" line. Windows with the cursor on the last line keep following the end.
+function! lldb#util#buffer_append(bufnr, lines)
+  let last = nvim_buf_line_count(a:bufnr)
+  let following = filter(win_findbuf(a:bufnr), 'nvim_win_get_cursor(v:val)[0] == last')
+  let tail = nvim_buf_get_lines(a:bufnr, -2, -1, 1)[0]
+  call nvim_buf_set_option(a:bufnr, 'modifiable', 1)
+  call nvim_buf_set_lines(a:bufnr, -2, -1, 1, [tail . a:lines[0]] + a:lines[1:])
+  call nvim_buf_set_option(a:bufnr, 'modifiable', 0)
+  let last = nvim_buf_line_count(a:bufnr)
+  for win in following
+    call nvim_win_set_cursor(win, [last, 0])
+  endfor
+endfun
+
+" Executes a list of commands in order, reporting (and skipping) failed ones.
+function! lldb#util#exec_all(cmds)
+  for cmd in a:cmds
+    try
+      exe cmd
+    catch
+      echohl ErrorMsg | echom v:exception | echohl None
+    endtry
   endfor
-  exe old_wnr . "wincmd w"
 endfun
@@ -26,6 +26,7 @@ highlight default link LLUnselectedPCSign NonText
 highlight default link LLUnselectedPCLine DiffChange
 highlight default link LLSelectedPCSign Debug
 highlight default link LLSelectedPCLine DiffText
+highlight default link LLRegisterChanged WarningMsg
 
 execute 'sign define llsign_bpres text=' . s:bp_symbol .
     \ ' texthl=LLBreakpointSign linehl=LLBreakpointLine'
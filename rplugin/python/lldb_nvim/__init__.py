@@ -2,19 +2,11 @@ from __future__ import (absolute_import, division, print_function)
 
 import logging
 import neovim
-from . import check_lldb
+from .scheduler import EventLoopError
+from .vim_x import VimX
 
 __metaclass__ = type  # pylint: disable=invalid-name
 
-if not check_lldb.probe():
-    logging.getLogger(__name__).critical('LLDB could not be imported!')
-    # ImportError will be raised in Controller import below.
-
-# pylint: disable=wrong-import-position
-from .controller import Controller, EventLoopError  # NOQA
-from .vim_x import VimX  # NOQA
-# pylint: enable=wrong-import-position
-
 
 @neovim.plugin  # pylint: disable=too-few-public-methods
 class Middleman:
@@ -22,28 +14,59 @@ class Middleman:
     def __init__(self, vim):
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
-        self.ctrl = Controller(VimX(vim))
-        self.ctrl.start()
-        if self.ctrl.vimx._vim_test:  # pylint: disable=protected-access
+        self.vimx = VimX(vim)
+        self.ctrl = None  # created (along with the debugger) by ctrl_start()
+        self.deferred = []  # calls made before then
+        if self.vimx._vim_test:  # pylint: disable=protected-access
             print("Note: `:LL-` commands are not bound with this test instance")
         else:
             vim.command('call lldb#remote#init(%d)' % vim.channel_id)
 
+    def ctrl_start(self):
+        """ Import lldb, and create the Controller (with its debugger) on first use. Then
+            make the calls deferred until then.
+        """
+        if self.ctrl is not None:
+            return
+        from . import check_lldb
+        if not check_lldb.probe():
+            self.logger.critical('LLDB could not be imported!')
+            # ImportError will be raised in Controller import below.
+        from .controller import Controller
+        self.ctrl = Controller(self.vimx)
+        self.ctrl.start()
+        (deferred, self.deferred) = (self.deferred, [])
+        for (method_name, args) in deferred:
+            getattr(self, method_name)(*args)
+
+    def ctrl_ready(self, method_name, *args):
+        """ Returns True if the Controller was created. Otherwise, the call to a method (of
+            this object) is deferred until it is.
+        """
+        if self.ctrl is None:
+            self.deferred.append((method_name, args))
+            return False
+        return True
+
     # The only interface that is predefined in the remote plugin manifest file.
     # The first execution of `:LLsession` initializes the remote part of the plugin.
     @neovim.command('LLsession', nargs='+', complete='customlist,lldb#session#complete')
     def _session(self, args):
+        self.ctrl_start()
         self.ctrl.safe_call(self.ctrl.session.handle, args)
 
     @neovim.rpc_export('mode')
     def _mode(self, mode):
+        self.ctrl_start()
         self.ctrl.safe_call(self.ctrl.session.mode_setup, [mode])
 
     @neovim.rpc_export('exec')
     def _exec(self, *args):
         if len(args) == 0:
-            self.ctrl.vimx.log("Usage :LL <lldb-command> [args...]", level=2)
-        elif args[0] in ['di', 'dis', 'disassemble']:
+            self.vimx.log("Usage :LL <lldb-command> [args...]", level=2)
+            return
+        self.ctrl_start()
+        if args[0] in ['di', 'dis', 'disassemble']:
             self.ctrl.safe_call(self.ctrl.change_buffer_cmd, ['disassembly', ' '.join(args)])
         elif args[0] in ['bt', '_regexp-bt']:
             self.ctrl.safe_call(self.ctrl.change_buffer_cmd, ['backtrace', ' '.join(args)])
@@ -52,26 +75,31 @@ class Middleman:
             if args[0] == 'help':
                 self.ctrl.vimx.command('drop [lldb]logs')
 
+    @neovim.rpc_export('cancel')
+    def _cancel(self):
+        if self.ctrl is not None:
+            self.ctrl.interrupt()
+
     @neovim.rpc_export('stdin')
     def _stdin(self, strin):
-        self.ctrl.safe_call(self.ctrl.put_stdin, [strin])
+        if self.ctrl_ready('_stdin', strin):
+            self.ctrl.safe_call(self.ctrl.put_stdin, [strin])
 
     @neovim.rpc_export('exit')
     def _exit(self):
-        self.ctrl.safe_exit()
+        if self.ctrl is not None:
+            self.ctrl.safe_exit()
 
     @neovim.rpc_export('complete', sync=True)
     def _complete(self, arg, line, pos):
+        self.ctrl_start()
         # FIXME user-customizable timeout?
-        try:
-            return self.ctrl.safe_call(self.ctrl.complete_command,
-                                       [arg, line, pos], True, timeout=3)
-        except EventLoopError as e:
-            self.logger.warn("%s on %s | %s", str(e), repr(line[:pos]), repr(line[pos:]))
-            return []
+        return self.ctrl.completer.complete(arg, line, pos, timeout=3)
 
     @neovim.rpc_export('get_modes', sync=True)
     def _get_modes(self):
+        if self.ctrl is None:  # no session was loaded yet
+            return []
         try:
             return self.ctrl.safe_call(self.ctrl.session.get_modes,
                                        [], True, timeout=1)
@@ -81,6 +109,8 @@ class Middleman:
 
     @neovim.rpc_export('select_thread_and_frame')
     def _select_thread_and_frame(self, thread_and_frame_idx):
+        if not self.ctrl_ready('_select_thread_and_frame', thread_and_frame_idx):
+            return
         if thread_and_frame_idx[0]:
             self.ctrl.safe_execute(['thread', 'select', thread_and_frame_idx[0]])
         if thread_and_frame_idx[1]:
@@ -88,19 +118,47 @@ class Middleman:
 
     @neovim.rpc_export('btswitch')
     def _btswitch(self):
-        self.ctrl.safe_call(self.ctrl.do_btswitch)
+        if self.ctrl_ready('_btswitch'):
+            self.ctrl.safe_call(self.ctrl.do_btswitch)
+
+    @neovim.rpc_export('toggle')
+    def _toggle(self, buf, line):
+        if self.ctrl_ready('_toggle', buf, line):
+            self.ctrl.safe_call(self.ctrl.do_toggle, [buf, line])
 
     @neovim.rpc_export('breakswitch')
-    def _breakswitch(self, bufnr, line):
-        self.ctrl.safe_call(self.ctrl.do_breakswitch, [bufnr, line])
+    def _breakswitch(self, path, line):
+        if self.ctrl_ready('_breakswitch', path, line):
+            self.ctrl.safe_call(self.ctrl.do_breakswitch, [path, line])
 
     @neovim.rpc_export('breakdelete')
     def _breakdelete(self, bp_id):
-        self.ctrl.safe_call(self.ctrl.do_breakdelete, [bp_id])
+        if self.ctrl_ready('_breakdelete', bp_id):
+            self.ctrl.safe_call(self.ctrl.do_breakdelete, [bp_id])
 
     @neovim.rpc_export('refresh')
     def _refresh(self):
-        self.ctrl.safe_call(self.ctrl.update_buffers)
+        if self.ctrl_ready('_refresh'):
+            self.ctrl.safe_call(self.ctrl.update_buffers, [None, True], coalesce=True)
+
+    @neovim.rpc_export('shown')
+    def _shown(self, heights):
+        # Before the Controller is created, there are no debugger buffers to refresh
+        if self.ctrl is not None:
+            self.ctrl.safe_call(self.ctrl.update_shown, [heights], coalesce=True)
+
+    @neovim.rpc_export('fileshown')
+    def _fileshown(self, files):
+        # Shown files are listed when the first breakpoint sign is placed
+        if self.ctrl is not None:
+            self.ctrl.safe_call(self.ctrl.buffers.files_shown, [files])
+
+    @neovim.rpc_export('bufdelete')
+    def _bufdelete(self, bufnr):
+        if self.ctrl is not None:
+            self.ctrl.safe_call(self.ctrl.buffers.buffer_deleted, [bufnr])
+        else:
+            self.vimx.buffer_forget(bufnr)
 
     @neovim.rpc_export('watchswitch')
     def _watchpoint(self, var_name):
@@ -0,0 +1,79 @@
+# Indexes breakpoint locations by source file and line.
+
+from __future__ import (absolute_import, division, print_function)
+
+from bisect import bisect_left, bisect_right, insort
+
+__metaclass__ = type  # pylint: disable=invalid-name
+
+
+class BreakpointIndex:
+    """ Maps file -> sorted lines -> breakpoint ids, and each breakpoint id to its locations.
+        Lines of a file are kept sorted, so that breakpoints in a range of lines (e.g. those
+        shown in a window) can be found without walking the others.
+    """
+
+    def __init__(self):
+        self._files = {}  # maps path -> (sorted list of lines, {line: [bp_id, ...]})
+        self._bp_locs = {}  # maps bp_id -> [(path, line), ...]
+
+    def __contains__(self, loc):
+        (path, line) = loc
+        return path in self._files and line in self._files[path][1]
+
+    def clear(self):
+        self._files = {}
+        self._bp_locs = {}
+
+    def add(self, bp_id, path, line):
+        """ Adds a location of a breakpoint. """
+        if path not in self._files:
+            self._files[path] = ([], {})
+        (lines, line_bps) = self._files[path]
+        if line in line_bps:
+            if bp_id in line_bps[line]:  # another location at the same line
+                return
+            line_bps[line].append(bp_id)
+        else:
+            line_bps[line] = [bp_id]
+            insort(lines, line)
+        self._bp_locs.setdefault(bp_id, []).append((path, line))
+
+    def remove(self, bp_id):
+        """ Removes all locations of a breakpoint. Returns the locations (path, line) left
+            without any breakpoint.
+        """
+        emptied = []
+        for (path, line) in self._bp_locs.pop(bp_id, []):
+            (lines, line_bps) = self._files[path]
+            bp_ids = [i for i in line_bps.get(line, []) if i != bp_id]
+            if bp_ids:
+                line_bps[line] = bp_ids
+            elif line in line_bps:
+                del line_bps[line]
+                del lines[bisect_left(lines, line)]
+                emptied.append((path, line))
+                if not lines:
+                    del self._files[path]
+        return emptied
+
+    def lookup(self, path, line):
+        """ Returns the ids of breakpoints at a line of a file. """
+        if path not in self._files:
+            return []
+        return list(self._files[path][1].get(line, []))
+
+    def lines(self, path, first=1, last=None):
+        """ Returns the sorted lines of a file, between first and last (inclusive), which
+            have breakpoints.
+        """
+        if path not in self._files:
+            return []
+        lines = self._files[path][0]
+        start = bisect_left(lines, first)
+        end = len(lines) if last is None else bisect_right(lines, last)
+        return lines[start:end]
+
+    def paths(self):
+        """ Returns the files with breakpoints. """
+        return list(self._files)
@@ -2,12 +2,65 @@
 
 from __future__ import (absolute_import, division, print_function)
 
+import json
 import os
 import sys
 
 __metaclass__ = type  # pylint: disable=invalid-name
 
 
+def find_executable(name):
+    """ Returns the path of an executable, as found on PATH (unless name is a path), or None. """
+    if os.path.dirname(name):
+        return name if os.access(name, os.X_OK) else None
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def cache_file():
+    """ Returns the path of the file caching the result of `lldb -P`. """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'lldb.nvim', 'lldb_path.json')
+
+
+def cache_key(lldb_path):
+    """ Returns what the result of `lldb -P` depends on: the path and modification time of
+        the lldb executable, and the python version.
+    """
+    try:
+        mtime = os.path.getmtime(lldb_path)
+    except OSError:
+        return None
+    return [os.path.realpath(lldb_path), mtime, list(sys.version_info[:3])]
+
+
+def cache_read(key):
+    """ Returns the cached result of `lldb -P`, if cached for the same key. """
+    try:
+        with open(cache_file()) as f:
+            cache = json.load(f)
+        if cache.get('key') == key:
+            return cache.get('path')
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def cache_write(key, path):
+    """ Caches the result of `lldb -P` for a key (see cache_key()). """
+    cache = cache_file()
+    try:
+        if not os.path.isdir(os.path.dirname(cache)):
+            os.makedirs(os.path.dirname(cache))
+        with open(cache, 'w') as f:
+            json.dump({'key': key, 'path': path}, f)
+    except (IOError, OSError):
+        pass
+
+
 def probe():  # pylint: disable=too-many-branches
     """ Find and import the lldb modules. This function tries to find the lldb module by:
         1. Simply by doing "import lldb" in case the system python installation is aware of lldb.
@@ -15,7 +68,9 @@ def probe():  # pylint: disable=too-many-branches
         2. Executes the lldb executable pointed to by the LLDB environment variable (or if unset,
            the first lldb on PATH") with the -P flag to determine the PYTHONPATH to set. If the
            lldb executable returns a valid path, it's added to sys.path and the import is attempted
-           again. If that fails, 3. On Mac OS X the default Xcode 4.5 installation path.
+           again. The path is cached on disk, for as long as the lldb executable and python
+           version stay the same. If that fails,
+        3. On Mac OS X the default Xcode 4.5 installation path.
     """
 
     # Try simple 'import lldb', in case of a system-wide install or a pre-configured PYTHONPATH
@@ -30,20 +85,35 @@ def probe():  # pylint: disable=too-many-branches
     if 'LLDB' in os.environ and os.path.exists(os.environ['LLDB']):
         lldb_executable = os.environ['LLDB']
 
+    lldb_path = find_executable(lldb_executable)
+    key = cache_key(lldb_path) if lldb_path else None
+
+    # Try the location that 'lldb -P' returned before
+    lldb_minus_p_path = cache_read(key) if key else None
+    if lldb_minus_p_path and os.path.exists(lldb_minus_p_path):
+        sys.path.append(lldb_minus_p_path)
+        try:
+            import lldb  # NOQA
+            return True
+        except ImportError:
+            sys.path.remove(lldb_minus_p_path)
+
     # Try using builtin module location support ('lldb -P')
     from subprocess import check_output, CalledProcessError
     try:
         with open(os.devnull, 'w') as fnull:
             lldb_minus_p_path = check_output(
-                "%s -P" % lldb_executable, shell=True, stderr=fnull).strip()
+                [lldb_path or lldb_executable, '-P'], stderr=fnull).strip()
         if not os.path.exists(lldb_minus_p_path):
             # lldb -P returned invalid path, probably too old
             pass
         else:
             sys.path.append(lldb_minus_p_path)
             import lldb  # NOQA
+            if key:
+                cache_write(key, lldb_minus_p_path)
             return True
-    except CalledProcessError:
+    except (CalledProcessError, OSError):
         # Cannot run 'lldb -P' to determine location of lldb python module
         pass
     except ImportError:
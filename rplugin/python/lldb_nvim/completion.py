@@ -0,0 +1,148 @@
+# Completes LLDB commands on a thread of its own, apart from the Controller's event loop.
+
+from __future__ import (absolute_import, division, print_function)
+
+from Queue import Empty, Queue
+from threading import Thread
+import re
+
+__metaclass__ = type  # pylint: disable=invalid-name
+
+
+class Completer(Thread):  # pylint: disable=too-many-instance-attributes
+    """ Thread that serves command completions, so that they never wait behind the commands
+        queued in the event loop, where possible. The top-level commands are listed once, and
+        the last completion is reused while more characters are typed after it. Breakpoint
+        specifications are completed from a SymbolIndex, once it indexed some module. Other
+        completions are made by the command interpreter, from the event loop.
+    """
+
+    # Breakpoint specifications, as given to `b` or `breakpoint set`
+    BP_SPEC = re.compile(r'\s*(b|tbreak|_regexp-t?break)\s+(?P<text>\S*)$')
+    BP_OPTION = re.compile(r'\s*br\w*\s+se\w*\s+(.*\s)?'
+                           r'(?P<option>-[fnF]|--file|--name|--fullname)\s+(?P<text>\S*)$')
+    FILE_LINE = re.compile(r'[^:]+:[0-9]*$')
+    INTERPRETER_TIMEOUT = 3  # seconds to wait for the event loop to complete a line
+
+    def __init__(self, ctrl, symbols):
+        import logging
+        self.logger = logging.getLogger(__name__)
+
+        self._ctrl = ctrl
+        self._symbols = symbols
+        self._requests = Queue()
+        self._stopped = False
+        self._commands = None  # the sorted top-level commands
+        self._last = None  # (line, candidates) of the last completion at the end of a line
+
+        super(Completer, self).__init__()
+        self.daemon = True
+
+    def complete(self, arg, line, pos, timeout=None):
+        """ (thread-safe) Returns a list of viable completions for line, and cursor at pos,
+            or an empty list if not found within timeout seconds.
+        """
+        if self._stopped:
+            return []
+        if not self.is_alive():
+            self.start()
+        out = Queue(1)
+        self._requests.put(((arg, line, int(pos)), out))
+        try:
+            return out.get(True, timeout)
+        except Empty:
+            self.logger.warn("Completion timed out on %s | %s",
+                             repr(line[:pos]), repr(line[pos:]))
+            return []
+
+    def invalidate(self):
+        """ (thread-safe) Forget the last completion, after the debugger state changed. """
+        self._last = None
+
+    def stop(self):
+        self._stopped = True
+        if self.is_alive():
+            self._requests.put((None, None))
+
+    def run(self):
+        while True:
+            (args, out) = self._requests.get()
+            if args is None:
+                break
+            if not self._requests.empty():  # superseded by a newer request
+                out.put([])
+                continue
+            try:
+                out.put(self.get_completions(*args))
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception("Completion failed on %s", repr(args))
+                out.put([])
+
+    def get_commands(self):
+        """ Returns the sorted list of top-level commands (and aliases). """
+        if self._commands is None:
+            self._commands = sorted(set([x for x in self.get_candidates('', 0) if x]))
+        return self._commands
+
+    def get_candidates(self, line, pos):
+        """ Returns the candidates of the command interpreter for line, and cursor at pos.
+            The interpreter is only used from the event loop, which may be running a command.
+        """
+        return self._ctrl.safe_call(self._ctrl.get_completion_candidates, [line, pos],
+                                    True, self.INTERPRETER_TIMEOUT)
+
+    def get_breakpoint_completions(self, line):
+        """ Returns completions of the breakpoint specification line ends with, from the
+            symbol index. Returns None if line does not end with one, or if the module of
+            the executable was not indexed yet.
+        """
+        if not self._symbols.is_ready():
+            return None
+        match = self.BP_SPEC.match(line)
+        if match:
+            text = match.group('text')
+            if self.FILE_LINE.match(text):  # only the line is left to complete
+                return []
+            return self._symbols.lookup_functions(text) + \
+                [name + ':' for name in self._symbols.lookup_files(text)]
+        match = self.BP_OPTION.match(line)
+        if match:
+            if match.group('option') in ['-f', '--file']:
+                return self._symbols.lookup_files(match.group('text'))
+            return self._symbols.lookup_functions(match.group('text'))
+        return None
+
+    def get_completions(self, arg, line, pos):
+        """ Returns a list of viable completions for line, and cursor at pos. """
+        if arg == line and line != '':
+            # provide all possible completions when completing 't', 'b', 'di' etc.
+            cands = [x for x in self.get_commands() if x.startswith(line)]
+            if line in cands:
+                cands.remove(line)
+                cands.insert(0, line)
+            return cands
+
+        at_end = pos == len(line)
+        if at_end:
+            cands = self.get_breakpoint_completions(line)
+            if cands is not None:
+                return cands
+
+        last = self._last
+        if at_end and last is not None and line.startswith(last[0]):
+            typed = line[len(last[0]):]
+            if typed and not any(c.isspace() for c in typed):
+                cands = [x for x in last[1] if x.startswith(arg)]
+                # An exact match might complete further (e.g. a directory)
+                if cands and arg not in cands:
+                    return cands
+
+        cands = self.get_candidates(line, pos)
+        if len(cands) < 2 or cands[0] == '' and arg != '' and \
+                not (cands[1].startswith(arg) and cands[-1].startswith(arg)):
+            cands = []
+        else:
+            cands = cands[1:]
+        if at_end:
+            self._last = (line, cands)
+        return cands
@@ -1,21 +1,24 @@
 from __future__ import (absolute_import, division, print_function)
 
-from threading import Thread
-from Queue import Queue, Empty, Full
+from collections import OrderedDict
+from threading import Lock, Thread
+from time import sleep, time
+import re
 
 import lldb
 
+from .completion import Completer
+from .lldb_utils import settings_target_source_map
+from .path_resolver import PathResolver
+from .scheduler import EventLoopError, Scheduler
 from .vim_buffers import VimBuffers
 from .session import Session
+from .symbol_index import SymbolIndex
 
 __metaclass__ = type  # pylint: disable=invalid-name
 
 
-class EventLoopError(Exception):
-    pass
-
-
-class Controller(Thread):  # pylint: disable=too-many-instance-attributes
+class Controller(Thread):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """ Thread object that handles LLDB events and commands. """
 
     CTRL_VOICE = 238  # doesn't matter what this is
@@ -23,9 +26,24 @@ class Controller(Thread):  # pylint: disable=too-many-instance-attributes
     TARG_DEL = 1 << 1
     PROC_NEW = 1 << 2
     PROC_DEL = 1 << 3
-    BP_CHANGED = 1 << 4
     BAD_STATE = 1 << 5  # multiple targets
 
+    # Breakpoint events which can change where a breakpoint is shown
+    BP_EVENTS = (lldb.eBreakpointEventTypeAdded | lldb.eBreakpointEventTypeRemoved |
+                 lldb.eBreakpointEventTypeLocationsAdded |
+                 lldb.eBreakpointEventTypeLocationsRemoved |
+                 lldb.eBreakpointEventTypeLocationsResolved)
+
+    OUTPUT_CHUNK = 1 << 14  # bytes read per GetSTDOUT() or GetSTDERR() call
+    OUTPUT_FLUSH_SIZE = 1 << 16  # bytes of process output to coalesce at most
+    OUTPUT_DELAY = 0.02  # seconds to coalesce process output for
+
+    # Commands that cannot change what the debugger buffers show at a given stop
+    READONLY_COMMANDS = re.compile(
+        r'\s*(help|apropos|version|b|br|breakpoint|tbreak|watchpoint|'
+        r'settings\s+(show|list)|image\s+(list|lookup|dump|show-unwind)|source|di|dis|'
+        r'disassemble)(\s|$)')
+
     def __init__(self, vimx):
         """ Creates the LLDB SBDebugger object and more! """
         import logging
@@ -39,19 +57,26 @@ class Controller(Thread):  # pylint: disable=too-many-instance-attributes
         self._rcx = lldb.SBListener("the_ear")  # receiver
         self._trx = lldb.SBBroadcaster("the_mouth")  # transmitter for user events
         self._trx.AddListener(self._rcx, self.CTRL_VOICE)
+        self.paths = PathResolver(self.paths_resolved)
+        self.symbols = SymbolIndex(self.paths.prefetch)
+        self.completer = Completer(self, self.symbols)
 
         self.target = None
         self._process = None
         self._proc_cur_line_len = 0
         self._proc_lines_count = 0
         self._proc_sigstop_count = 0
-        self._num_bps = 0
+        self._source_map = None
+        self._source_map_stale = True
 
-        self.in_queue = Queue(maxsize=2)
-        self.out_queue = Queue(maxsize=1)
+        self.tasks = Scheduler()
+        self._running_task = None
+        self._interrupted = None  # the task interrupt() was called on
+        self._interrupt_lock = Lock()
 
         self.vimx = vimx
         self.busy_stack = 0  # when > 0, buffers are not updated
+        self.update_forced = False  # whether the update queued by schedule_update() is forced
         self.buffers = VimBuffers(self, vimx)
         self.session = Session(self, vimx)
 
@@ -69,30 +94,70 @@ class Controller(Thread):  # pylint: disable=too-many-instance-attributes
             self.logger.critical("busy_stack < 0")
             self.busy_stack = 0
 
-    def safe_call(self, method, args=None, sync=False, timeout=None):
+    # pylint: disable=too-many-arguments
+    def safe_call(self, method, args=None, sync=False, timeout=None, coalesce=False):
         """ (thread-safe) Call `method` with `args`. If `sync` is True, wait for
             `method` to complete and return its value. If timeout is set and non-
             negative, and the `method` did not complete within `timeout` seconds,
-            an EventLoopError is raised!
+            an EventLoopError is raised! If `coalesce` is True, the call is merged
+            with an identical one that is still waiting to be made (if any).
         """
         if self._dbg is None:
             self.logger.critical("Debugger not found!")
             raise EventLoopError("Dead debugger!")
-        if self.out_queue.full():  # garbage
-            self.out_queue.get()  # clean
-
-        try:
-            self.in_queue.put((method, args if args else [], sync), block=False)
-            interrupt = lldb.SBEvent(self.CTRL_VOICE, "the_sound")
-            self._trx.BroadcastEvent(interrupt)
-            if sync:
-                return self.out_queue.get(block=True, timeout=timeout)
-        except Empty:
-            raise EventLoopError("Timed out!")
-        except Full:
-            self.logger.critical("Event loop thread is probably dead!")
+        if not self.is_alive():
+            self.logger.critical("Event loop thread is dead!")
             raise EventLoopError("Dead event loop!")
 
+        task = self.tasks.put(method, args if args else [], coalesce)
+        interrupt = lldb.SBEvent(self.CTRL_VOICE, "the_sound")
+        self._trx.BroadcastEvent(interrupt)
+        if sync:
+            return task.wait(timeout)
+        return None
+    # pylint: enable=too-many-arguments
+
+    def schedule_update(self, force=False):
+        """ Queue an update of all buffers, to be made after any pending calls. The update is
+            forced (see update_buffers) if any of the calls it was coalesced from is.
+            Should only be called from this thread.
+        """
+        self.update_forced = self.update_forced or force
+        self.tasks.put(self.scheduled_update, [], coalesce=True, background=True)
+
+    def scheduled_update(self):
+        """ Make the update queued by schedule_update(). """
+        (force, self.update_forced) = (self.update_forced, False)
+        if not self.is_busy():
+            self.buffers.update(self.target, force)
+
+    def paths_resolved(self):
+        """ (thread-safe) Called by the path resolver once it resolved all queued paths. """
+        self.tasks.put(self.update_unresolved, [], coalesce=True, background=True)
+        self._trx.BroadcastEvent(lldb.SBEvent(self.CTRL_VOICE, "the_sound"))
+
+    def update_unresolved(self):
+        """ Place the signs that were waiting on their paths to be resolved. """
+        self.buffers.update_unresolved(self.target)
+
+    def should_yield(self):
+        """ Returns True if a (background) task should stop early, to let other calls in. """
+        return self.tasks.has_foreground()
+
+    def interrupt(self):
+        """ (thread-safe) Interrupt the call being made from the event loop (if any), by
+            requesting the debugger to interrupt the command being run.
+        """
+        if not hasattr(self._dbg, 'RequestInterrupt'):  # LLDB < 17
+            self.vimx.log('Interrupting commands is not supported by this LLDB!', 0)
+            return
+        with self._interrupt_lock:
+            if self._running_task is None:
+                self.vimx.log('Nothing to cancel!', 0)
+                return
+            self._interrupted = self._running_task
+            self._dbg.RequestInterrupt()
+
     def safe_execute(self, tokens):
         """ (thread-safe) Executes an lldb command defined by a list of tokens.
             If a token contains white-spaces, they are escaped using backslash.
@@ -104,51 +169,46 @@ class Controller(Thread):  # pylint: disable=too-many-instance-attributes
         """ Exit from the event-loop, and wait for the thread to join.
             Should be called from outside this thread.
         """
+        self.completer.stop()
         self.safe_call(None)
         self.join()
 
-    def complete_command(self, arg, line, pos):
-        """ Returns a list of viable completions for line, and cursor at pos. """
-        pos = int(pos)
-        result = lldb.SBStringList()
-
-        if arg == line and line != '':
-            # provide all possible completions when completing 't', 'b', 'di' etc.
-            self._ipreter.HandleCompletion('', 0, 1, -1, result)
-            cands = ['']
-            for x in result:
-                if x == line:
-                    cands.insert(1, x)
-                elif x.startswith(line):
-                    cands.append(x)
-        else:
-            self._ipreter.HandleCompletion(line, pos, 1, -1, result)
-            cands = [x for x in result]
-
-        if len(cands) > 1:
-            if cands[0] == '' and arg != '':
-                if not cands[1].startswith(arg) or not cands[-1].startswith(arg):
-                    return []
-            return cands[1:]
-        else:
-            return []
-
-    def update_buffers(self, buf=None):
+    def update_buffers(self, buf=None, force=False):
         """ Update lldb buffers and signs placed in source files.
             @param buf
                 If None, all buffers and signs would be updated.
                 Otherwise, update only the specified buffer.
+            @param force
+                If True, also update buffers that are not currently shown.
         """
         if self.is_busy():
             return
         if buf is None:
-            self.buffers.update(self.target)
+            if force:
+                self.buffers.update_breakpoints(self.target)
+            self.buffers.update(self.target, force)
         else:
             self.buffers.update_buffer(buf, self.target)
 
+    def update_shown(self, heights):
+        """ Update buffers that were just shown, if they went stale while hidden.
+            @param heights
+                Maps buffer names to the heights of the windows showing them.
+        """
+        if self.is_busy():
+            return
+        self.buffers.update_dirty(heights, self.target)
+
+    def get_source_map(self):
+        """ Returns the target.source-map setting, as parsed by the last call after a change. """
+        if self._source_map_stale:
+            self._source_map = settings_target_source_map(self.get_command_result)
+            self._source_map_stale = False
+        return self._source_map
+
     def get_state_changes(self):  # pylint: disable=too-many-branches
-        """ Get a value denoting how target, process, and/or breakpoint have changed.
-            If a new process found, add our listener to its broadcaster.
+        """ Get a value denoting how target and/or process have changed.
+            If a new target or process found, add our listener to its broadcaster.
         """
         changes = 0
         if self._dbg.GetNumTargets() > 1:
@@ -159,6 +219,12 @@ class Controller(Thread):  # pylint: disable=too-many-instance-attributes
             if target.IsValid():
                 changes = self.TARG_NEW
                 self.target = target
+                target.GetBroadcaster().AddListener(
+                    self._rcx,
+                    lldb.SBTarget.eBroadcastBitBreakpointChanged |
+                    lldb.SBTarget.eBroadcastBitModulesLoaded |
+                    lldb.SBTarget.eBroadcastBitModulesUnloaded
+                )
             elif self.target is not None:
                 changes = self.TARG_DEL
                 self.target = None
@@ -167,9 +233,6 @@ class Controller(Thread):  # pylint: disable=too-many-instance-attributes
             if self._process is not None:
                 changes |= self.PROC_DEL
                 self._process = None
-            if self._num_bps > 0:
-                changes |= self.BP_CHANGED
-                self._num_bps = 0
             return changes
 
         if self._process is None or not self._process.IsValid():
@@ -190,12 +253,6 @@ class Controller(Thread):  # pylint: disable=too-many-instance-attributes
             elif self._process is not None:
                 changes |= self.PROC_DEL
                 self._process = None
-
-        num_bps = self.target.GetNumBreakpoints()
-        if self._num_bps != num_bps:
-            # TODO what if one was added and another deleted?
-            changes |= self.BP_CHANGED
-            self._num_bps = num_bps
         # TODO Watchpoints
 
         return changes
@@ -216,23 +273,26 @@ class Controller(Thread):  # pylint: disable=too-many-instance-attributes
             cmd = 'bt'
         self.change_buffer_cmd('backtrace', cmd)
 
+    def do_toggle(self, buf, line):
+        """ Expand or collapse the item at a line of a buffer. """
+        self.buffers.toggle(buf, line, self.target)
+
     def bp_set_line(self, spath, line):
         from os.path import abspath
         fpath = abspath(spath).encode('ascii', 'ignore')
         bp = self.target.BreakpointCreateByLocation(fpath, line)
         self.buffers.logs_append(u'\u2192(lldb-bp) %s:%d\n' % (spath, line))
+        self.process_target_events()
         self.session.bp_map_auto(bp, (spath, line))
         self.update_buffers(buf='breakpoints')
 
-    def do_breakswitch(self, bufnr, line):
-        """ Switch breakpoint at the specified line in the buffer. """
-        key = (bufnr, line)
-        if key in self.buffers.bp_list:
-            bps = self.buffers.bp_list[key]
-            args = "delete %s" % " ".join([str(b.GetID()) for b in bps])
-            self.exec_command("breakpoint " + args)
+    def do_breakswitch(self, path, line):
+        """ Switch breakpoint at the specified line of a file. """
+        bp_ids = self.buffers.bp_index.lookup(self.buffers.real_path(path), line)
+        if bp_ids:
+            self.exec_command("breakpoint delete %s" % " ".join([str(i) for i in bp_ids]))
         else:
-            self.bp_set_line(self.vimx.get_buffer_name(bufnr), line)
+            self.bp_set_line(path, line)
 
     def do_breakdelete(self, bp_id):
         """ Delete a breakpoint by id """
@@ -246,6 +306,12 @@ class Controller(Thread):  # pylint: disable=too-many-instance-attributes
         else:
             self.vimx.log('No active process!')
 
+    def get_completion_candidates(self, line, pos):
+        """ Returns the candidates of the command interpreter for line, and cursor at pos. """
+        result = lldb.SBStringList()
+        self._ipreter.HandleCompletion(line, pos, 1, -1, result)
+        return [x for x in result]
+
     def get_command_result(self, command, add2hist=False):
         """ Runs command in the interpreter and returns (success, output)
             Not to be called directly for commands which changes debugger state;
@@ -271,78 +337,199 @@ class Controller(Thread):  # pylint: disable=too-many-instance-attributes
             self.buffers.logs_append(output, u'\u2717')
         elif len(output) > 0:
             self.buffers.logs_append(output, u'\u2713')
+        source_map_changed = False
+        if success and not self.READONLY_COMMANDS.match(command):
+            self.buffers.invalidate_cache()
+            self.completer.invalidate()
+            source_map_changed = 'target.source-map' in command
 
         state_changes = self.get_state_changes()
+        target_changed = state_changes & (self.TARG_NEW | self.TARG_DEL) != 0
+        if source_map_changed or target_changed:
+            self._source_map_stale = True
+        if target_changed:
+            self.symbols.clear()
         if state_changes & self.TARG_NEW != 0:
             self.session.new_target(self.target)
-        elif state_changes & self.BP_CHANGED != 0 and self.target is not None:
-            self.session.bp_changed(command, self.target.breakpoint_iter())
+            self.symbols.set_executable(self.target.FindModule(self.target.GetExecutable()))
+            source_map = self.get_source_map()
+            for module in self.target.module_iter():
+                self.symbols.add_module(module, source_map)
+        # breakswitch depends on breakpoint signs, and may be called before the update below
+        if source_map_changed or target_changed:
+            self.process_target_events(command=command, signs=False)
+            self.buffers.update_breakpoints(self.target)
+        else:
+            self.process_target_events(command=command)
 
-        self.update_buffers()
+        self.schedule_update()
         return success
 
-    def run(self):  # pylint: disable=too-many-branches,too-many-statements
-        """ This thread's event loop. """
+    def read_process_output(self, limit):
+        """ Returns (up to about limit bytes of) what the process wrote to stdout and stderr. """
+        out = ''
+        while len(out) < limit:
+            chunk = ''
+            stdout = self._process.GetSTDOUT(self.OUTPUT_CHUNK)
+            if stdout is not None:
+                chunk += stdout
+            stderr = self._process.GetSTDERR(self.OUTPUT_CHUNK)
+            if stderr is not None:
+                chunk += stderr
+            if len(chunk) == 0:
+                break
+            out += chunk
+        return out
+
+    def dump_process_output(self):
+        """ Dump stdout and stderr of the process to the logs buffer. Output is coalesced for
+            OUTPUT_DELAY seconds (or up to OUTPUT_FLUSH_SIZE bytes) before each append.
+            Stops (or kills) a process that prints too much.
+        """
+        while True:
+            out = self.read_process_output(self.OUTPUT_FLUSH_SIZE)
+            if len(out) == 0:
+                break
+            deadline = time() + self.OUTPUT_DELAY
+            while len(out) < self.OUTPUT_FLUSH_SIZE and time() < deadline:
+                sleep(self.OUTPUT_DELAY / 4)
+                out += self.read_process_output(self.OUTPUT_FLUSH_SIZE - len(out))
+
+            n_lines = self.buffers.logs_append(out)
+            if n_lines == 0:
+                self._proc_cur_line_len += len(out)
+            else:
+                self._proc_cur_line_len = 0
+                self._proc_lines_count += n_lines
+            if self._proc_cur_line_len > 8192 or self._proc_lines_count > 2048:
+                # detect and stop/kill insane process
+                if self._process.state == lldb.eStateStopped:
+                    pass
+                elif self._proc_sigstop_count > 7:
+                    self._process.Kill()
+                    self.buffers.logs_append(
+                        u'\u2717SIGSTOP limit exceeded! Sent SIGKILL!\n')
+                else:
+                    self._process.SendAsyncInterrupt()
+                    self._proc_sigstop_count += 1
+                    self.buffers.logs_append(
+                        u'\u2717Output limits exceeded! Sent SIGSTOP!\n')
+                break
+
+    def process_module_event(self, event):
+        """ Handle an event broadcast by the target, if modules were loaded or unloaded. """
+        loaded = event.GetType() & lldb.SBTarget.eBroadcastBitModulesLoaded
+        if not loaded and not event.GetType() & lldb.SBTarget.eBroadcastBitModulesUnloaded:
+            return
+        # a module loaded at the address of one seen before may have been rebuilt
+        for i in range(lldb.SBTarget.GetNumModulesFromEvent(event)):
+            module = lldb.SBTarget.GetModuleAtIndexFromEvent(i, event)
+            self.buffers.instructions.drop_module(module)
+            if loaded:
+                self.symbols.add_module(module, self.get_source_map())
+            else:
+                self.symbols.remove_module(module)
+
+    def process_target_events(self, event=None, command=None, signs=True):
+        """ Handle the pending events broadcast by the target (after event, if given).
+            Breakpoints added or removed are passed to the session, along with the command
+            which did so, if any. Returns True if any breakpoint changed.
+            @param signs
+                Whether to update the signs of changed breakpoints.
+        """
+        if self.target is None:
+            return False
+        broadcaster = self.target.GetBroadcaster()
+        if event is None:
+            event = lldb.SBEvent()
+            if not self._rcx.GetNextEventForBroadcaster(broadcaster, event):
+                return False
+
+        (new_bps, del_bp_ids) = ([], [])
+        bp_changes = OrderedDict()  # maps id -> (breakpoint, whether it was removed)
+        while True:
+            event_type = event.GetType()
+            if event_type & lldb.SBTarget.eBroadcastBitBreakpointChanged:
+                bp = lldb.SBBreakpoint.GetBreakpointFromEvent(event)
+                bp_event = lldb.SBBreakpoint.GetBreakpointEventTypeFromEvent(event)
+                if bp_event & lldb.eBreakpointEventTypeAdded:
+                    new_bps.append(bp)
+                elif bp_event & lldb.eBreakpointEventTypeRemoved:
+                    del_bp_ids.append(bp.GetID())
+                if bp_event & self.BP_EVENTS:
+                    removed = bp_event & lldb.eBreakpointEventTypeRemoved != 0
+                    bp_changes[bp.GetID()] = (bp, removed)
+            self.process_module_event(event)
+            if not self._rcx.GetNextEventForBroadcaster(broadcaster, event):
+                break
+
+        # signs are placed (and buffers added) for all the changed breakpoints at once
+        if signs and bp_changes:
+            self.buffers.update_bp_signs(bp_changes.values())
+        if new_bps or del_bp_ids:
+            self.session.bp_changed(command, new_bps, del_bp_ids)
+        return len(bp_changes) > 0
+
+    def run_tasks(self):
+        """ Make all queued calls. Returns False if asked to exit the event loop. """
         import traceback
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return True
+            if task.method is None:
+                task.finish()
+                return False
+            self._running_task = task
+            try:
+                self.logger.info('Calling %s with %s', task.method.func_name, repr(task.args))
+                task.finish(task.method(*task.args))
+            except Exception:  # pylint: disable=broad-except
+                self.logger.critical(traceback.format_exc())
+                task.finish()
+            with self._interrupt_lock:
+                self._running_task = None
+                interrupted = self._interrupted is task
+                self._interrupted = None
+                if interrupted:  # don't let a pending request interrupt the next task
+                    self._dbg.CancelInterruptRequest()
+            if interrupted:
+                self.buffers.invalidate_cache()  # outputs may be incomplete
+                self.buffers.logs_append(u'\u2717Interrupted!\n')
+
+    def run(self):
+        """ This thread's event loop. """
         to_count = 0
         while True:
             event = lldb.SBEvent()
             if self._rcx.WaitForEvent(30, event):  # 30 second timeout
 
-                def event_matches(broadcaster, skip=True):
+                def event_matches(broadcaster):
+                    """ Returns the union of types of the matched (and skipped) events. """
                     if event.BroadcasterMatchesRef(broadcaster):
-                        if skip:
-                            while self._rcx.GetNextEventForBroadcaster(broadcaster, event):
-                                pass
-                        return True
-                    return False
-
-                if event_matches(self._trx, skip=False):
-                    try:
-                        method, args, sync = self.in_queue.get(block=False)
-                        if method is None:
-                            break
-                        self.logger.info('Calling %s with %s', method.func_name, repr(args))
-                        ret = method(*args)
-                        if sync:
-                            self.out_queue.put(ret, block=False)
-                    except Exception:  # pylint: disable=broad-except
-                        self.logger.critical(traceback.format_exc())
-
-                elif event_matches(self._process.broadcaster):
-                    # Dump stdout and stderr to logs buffer
-                    while True:
-                        out = ''
-                        stdout = self._process.GetSTDOUT(256)
-                        if stdout is not None:
-                            out += stdout
-                        stderr = self._process.GetSTDERR(256)
-                        if stderr is not None:
-                            out += stderr
-                        if len(out) == 0:
-                            break
-                        n_lines = self.buffers.logs_append(out)
-                        if n_lines == 0:
-                            self._proc_cur_line_len += len(out)
-                        else:
-                            self._proc_cur_line_len = 0
-                            self._proc_lines_count += n_lines
-                        if self._proc_cur_line_len > 8192 or self._proc_lines_count > 2048:
-                            # detect and stop/kill insane process
-                            if self._process.state == lldb.eStateStopped:
-                                pass
-                            elif self._proc_sigstop_count > 7:
-                                self._process.Kill()
-                                self.buffers.logs_append(
-                                    u'\u2717SIGSTOP limit exceeded! Sent SIGKILL!\n')
-                            else:
-                                self._process.SendAsyncInterrupt()
-                                self._proc_sigstop_count += 1
-                                self.buffers.logs_append(
-                                    u'\u2717Output limits exceeded! Sent SIGSTOP!\n')
-                            break
-                    # end of dump while
-                    self.update_buffers()
+                        types = event.GetType()
+                        while self._rcx.GetNextEventForBroadcaster(broadcaster, event):
+                            types |= event.GetType()
+                        return types
+                    return 0
+
+                if event_matches(self._trx):
+                    pass
+                elif self.target is not None and \
+                        event.BroadcasterMatchesRef(self.target.GetBroadcaster()):
+                    if self.process_target_events(event):  # e.g. resolved in a new module
+                        self.schedule_update()
+                else:
+                    event_types = event_matches(self._process.broadcaster) if self._process else 0
+                    if event_types:
+                        self.dump_process_output()
+                        # Output alone does not change what the other buffers show
+                        if event_types & lldb.SBProcess.eBroadcastBitStateChanged:
+                            self.buffers.invalidate_cache()
+                            self.schedule_update()
+
+                if not self.run_tasks():
+                    break
 
             else:  # Timed out
                 to_count += 1
@@ -1,11 +1,140 @@
 from __future__ import (absolute_import, division, print_function)
 
+from collections import OrderedDict
 import os.path
 
 __metaclass__ = type  # pylint: disable=invalid-name
 
 
+class SourceMap:
+    """ Path prefix substitutions of target.source-map, held in a tree of path components, so
+        that finding the longest matching prefix of a path costs O(path depth).
+    """
+
+    def __init__(self, path_map):
+        self._len = len(path_map)
+        self._root = {}
+        for path_src, path_dest in path_map.items():
+            node = self._root
+            for comp in self._split(path_src):
+                node = node.setdefault(comp, {})
+            node[None] = path_dest  # None is never a path component
+
+    def __len__(self):
+        return self._len
+
+    @staticmethod
+    def _split(path):
+        return [comp for comp in path.split(os.path.sep) if comp]
+
+    def resolve(self, fullpath):
+        """ Returns fullpath with its longest mapped prefix (if any) substituted. """
+        comps = self._split(fullpath)
+        node = self._root
+        match = None
+        for i, comp in enumerate(comps[:-1]):  # the prefix must be a proper one
+            node = node.get(comp)
+            if node is None:
+                break
+            if None in node:
+                match = (node[None], i + 1)
+        if match is None:
+            return fullpath
+        path_dest, depth = match
+        return os.path.join(path_dest, *comps[depth:])
+
+
+def get_module_key(module):
+    """ Returns a key identifying a module: its UUID, or else its path. """
+    return module.GetUUIDString() or module.GetFileSpec().fullpath
+
+
+class InstructionCache:
+    """ A bounded (least recently used) cache of disassembled instructions, keyed by module and
+        load address. Instructions outside of modules are not cached.
+    """
+
+    def __init__(self, max_size=8192):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # maps (module key, load address) -> instruction tuple
+
+    def drop_module(self, module):
+        """ Forget the instructions of a module (which was unloaded or reloaded). """
+        mkey = get_module_key(module)
+        for key in [k for k in self._entries if k[0] == mkey]:
+            del self._entries[key]
+
+    @staticmethod
+    def disassemble(target, load_addr, count):
+        """ Returns tuples (load address, size, function, offset, mnemonic, operands, comment)
+            for up to count instructions starting at load_addr.
+        """
+        insts = []
+        for inst in target.ReadInstructions(target.ResolveLoadAddress(load_addr), count):
+            addr = inst.GetAddress()
+            inst_load_addr = addr.GetLoadAddress(target)
+            (function, offset) = ('', 0)
+            symbol = addr.GetSymbol()
+            if symbol.IsValid():
+                function = '%s`%s' % (addr.GetModule().GetFileSpec().GetFilename(),
+                                      symbol.GetName())
+                offset = inst_load_addr - symbol.GetStartAddress().GetLoadAddress(target)
+            insts.append((inst_load_addr, inst.GetByteSize(), function, offset,
+                          inst.GetMnemonic(target), inst.GetOperands(target),
+                          inst.GetComment(target)))
+        return insts
+
+    def read(self, target, address, count):
+        """ Returns tuples (as returned by disassemble()) for up to count instructions starting
+            at address (an SBAddress). Only instructions not in the cache are disassembled.
+        """
+        load_addr = address.GetLoadAddress(target)
+        module = address.GetModule()
+        if not module.IsValid():
+            return self.disassemble(target, load_addr, count)
+
+        mkey = get_module_key(module)
+        insts = []
+        while len(insts) < count:
+            key = (mkey, load_addr)
+            if key not in self._entries:
+                fetched = self.disassemble(target, load_addr, count - len(insts))
+                if not fetched:
+                    break
+                for inst in fetched:
+                    self._entries[(mkey, inst[0])] = inst
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                if key not in self._entries:  # evicted right away
+                    return insts + fetched
+            inst = self._entries.pop(key)
+            self._entries[key] = inst  # most recently used
+            insts.append(inst)
+            load_addr += inst[1]
+        return insts
+
+
+def format_instructions(insts, pc_load_addr):
+    """ Returns lines describing instructions (as returned by InstructionCache.read()), like
+        `disassemble`, grouped by function, with the one at pc_load_addr marked.
+    """
+    lines = []
+    function = None
+    for (load_addr, _, inst_function, offset, mnemonic, operands, comment) in insts:
+        if inst_function != function:
+            if lines:
+                lines.append('')
+            if inst_function:
+                lines.append('%s:' % inst_function)
+            function = inst_function
+        line = '%s  0x%x <+%d>: %-7s %s' % ('->' if load_addr == pc_load_addr else '  ',
+                                            load_addr, offset, mnemonic, operands)
+        lines.append(line + '  ; ' + comment if comment else line.rstrip())
+    return lines
+
+
 def settings_target_source_map(commander):
+    """ Returns a SourceMap for the target.source-map setting, or None on failure. """
     (success, output) = commander('settings show target.source-map')
     if not success:
         return None
@@ -21,26 +150,17 @@ def settings_target_source_map(commander):
             continue
         path_map[os.path.abspath(path_src)] = os.path.abspath(path_dest)
 
-    return path_map
+    return SourceMap(path_map)
 
 
 def resolve_line_entry(le, source_map=None):
     fullpath = le.file.fullpath
-    if not source_map:
-        return (fullpath, le.line)
-
-    fullpath_new = None
-    for path_src, path_dest in sorted(source_map.items(), key=lambda item: len(item[0])):
-        if fullpath.startswith(path_src + os.path.sep):
-            fullpath_new = path_dest + fullpath[len(path_src):]
-
-    if fullpath_new is not None:
-        fullpath = fullpath_new
-
+    if source_map and fullpath:
+        fullpath = source_map.resolve(fullpath)
     return (fullpath, le.line)
 
 
-def get_pc_source_loc(thread, commander):
+def get_pc_source_loc(thread, source_map=None):
     """ Returns a tuple (thread_index, file, line) that represents where
         the PC sign should be placed for a thread.
     """
@@ -53,7 +173,7 @@ def get_pc_source_loc(thread, commander):
 
     if le.IsValid():
         return (thread.GetIndexID(),) + \
-            resolve_line_entry(le, settings_target_source_map(commander))
+            resolve_line_entry(le, source_map)
     return None
 
 
@@ -69,6 +189,106 @@ def get_bploc_tuples(bp, source_map=None):
     return locs
 
 
+def get_stop_key(target):
+    """ Returns a tuple (pid, stop_id, thread_index, frame_index) identifying the current stop
+        of the target's process, or None if the process is not stopped.
+    """
+    from lldb import eStateStopped
+    if not target or not target.IsValid():
+        return None
+    proc = target.GetProcess()
+    if not proc or not proc.IsValid() or proc.GetState() != eStateStopped:
+        return None
+    thread = proc.GetSelectedThread()
+    return (proc.GetProcessID(), proc.GetStopID(True),
+            thread.GetIndexID(), thread.GetSelectedFrame().GetFrameID())
+
+
+def format_frame_location(frame, target):
+    """ Returns "<pc> <module>`<function> + <offset> at <file>:<line>" for a frame, like the
+        default frame-format of LLDB, but without the function arguments.
+    """
+    pc = frame.GetPC()
+    loc = '0x%0*x' % (target.GetAddressByteSize() * 2, pc)
+    module = frame.GetModule()
+    if module.IsValid():
+        loc += ' %s' % module.GetFileSpec().GetFilename()
+        name = frame.GetFunctionName()
+        if name:
+            start = frame.GetFunction().GetStartAddress()
+            if not start.IsValid():
+                start = frame.GetSymbol().GetStartAddress()
+            offset = pc - start.GetLoadAddress(target) if start.IsValid() else 0
+            loc += '`%s + %d' % (name, offset) if offset > 0 else '`%s' % name
+    le = frame.GetLineEntry()
+    if le.IsValid():
+        loc += ' at %s:%d' % (le.GetFileSpec().GetFilename(), le.GetLine())
+    return loc
+
+
+def format_thread(thread, target):
+    """ Returns a description of a thread, like the default thread-format of LLDB. """
+    from lldb import eStopReasonNone, eStopReasonInvalid
+    loc = format_frame_location(thread.GetFrameAtIndex(0), target)
+    desc = 'thread #%d: tid = 0x%x, %s' % (thread.GetIndexID(), thread.GetThreadID(), loc)
+    if thread.GetName():
+        desc += ", name = '%s'" % thread.GetName()
+    if thread.GetQueueName():
+        desc += ", queue = '%s'" % thread.GetQueueName()
+    if thread.GetStopReason() not in [eStopReasonNone, eStopReasonInvalid]:
+        desc += ', stop reason = %s' % thread.GetStopDescription(256)
+    return desc
+
+
+def format_frames(thread, max_lines):
+    """ Returns lines describing a thread and (up to max_lines - 1 of) its frames. """
+    target = thread.GetProcess().GetTarget()
+    selected = thread.GetIndexID() == thread.GetProcess().GetSelectedThread().GetIndexID()
+    lines = ['%s %s' % ('*' if selected else ' ', format_thread(thread, target))]
+    selected_id = thread.GetSelectedFrame().GetFrameID()
+    frame = thread.GetFrameAtIndex(0)
+    while frame.IsValid():
+        if len(lines) >= max_lines - 1 and thread.GetFrameAtIndex(len(lines)).IsValid():
+            lines.append('    ...')
+            break
+        lines.append('  %s frame #%d: %s' % ('*' if frame.GetFrameID() == selected_id else ' ',
+                                             frame.GetFrameID(),
+                                             format_frame_location(frame, target)))
+        frame = thread.GetFrameAtIndex(len(lines) - 1)
+    return lines
+
+
+def format_backtrace(process, height):
+    """ Returns the lines of `bt`: the frames of the selected thread. """
+    return format_frames(process.GetSelectedThread(), height)
+
+
+def format_backtrace_all(process, height):
+    """ Returns the lines of `bt all`: the frames of every thread, for as many as fit in
+        height.
+    """
+    lines = []
+    for thread in process:
+        if len(lines) >= height:
+            break
+        lines += format_frames(thread, height - len(lines)) + ['']
+    return lines
+
+
+def format_threads(process, height):
+    """ Returns the lines of `thread list`. """
+    target = process.GetTarget()
+    selected_id = process.GetSelectedThread().GetIndexID()
+    lines = ['Process %d stopped' % process.GetProcessID()]
+    for thread in process:
+        if len(lines) >= height:
+            lines.append('  ...')
+            break
+        lines.append('%s %s' % ('*' if thread.GetIndexID() == selected_id else ' ',
+                                format_thread(thread, target)))
+    return lines
+
+
 def get_description(lldb_obj):
     from lldb import SBStream
     s = SBStream()
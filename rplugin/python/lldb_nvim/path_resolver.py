@@ -0,0 +1,75 @@
+# Resolves source file paths on worker threads, so that slow file systems (e.g. network
+# mounts) never block the event loop.
+
+from __future__ import (absolute_import, division, print_function)
+
+from os.path import exists, realpath
+from Queue import Queue
+from threading import Lock, Thread
+from time import time
+
+__metaclass__ = type  # pylint: disable=invalid-name
+
+
+class PathResolver:  # pylint: disable=too-many-instance-attributes
+    """ A cache of whether paths exist, and their real paths. Paths not in the cache (or
+        whose entries expired) are resolved by a pool of worker threads, which then call
+        `on_resolved` with no arguments, once there is nothing left to resolve.
+    """
+
+    def __init__(self, on_resolved=None, workers=4, ttl=30.0):
+        self.on_resolved = on_resolved
+        self.ttl = ttl
+        self._num_workers = workers
+        self._workers = []
+        self._lock = Lock()
+        self._cache = {}  # maps path -> (expiry time, real path, or None if missing)
+        self._pending = set()  # paths queued for resolution
+        self._queue = Queue()
+
+    def lookup(self, path):
+        """ Returns a tuple (known, real path or None if path does not exist). Expired
+            entries are still returned, while being resolved again; paths never resolved
+            are queued for resolution.
+        """
+        entry = self._cache.get(path)
+        if entry is None or entry[0] < time():
+            self.prefetch([path])
+        if entry is None:
+            return (False, None)
+        return (True, entry[1])
+
+    def exists(self, path):
+        """ Returns whether path exists, or None if not known yet. """
+        (known, real) = self.lookup(path)
+        return real is not None if known else None
+
+    def prefetch(self, paths):
+        """ Queue paths for resolution, unless resolved recently or already queued. """
+        now = time()
+        with self._lock:
+            if not self._workers:
+                for _ in range(self._num_workers):
+                    worker = Thread(target=self._work)
+                    worker.daemon = True
+                    worker.start()
+                    self._workers.append(worker)
+            for path in paths:
+                entry = self._cache.get(path)
+                if path and path not in self._pending and (entry is None or entry[0] < now):
+                    self._pending.add(path)
+                    self._queue.put(path)
+
+    def _work(self):
+        while True:
+            path = self._queue.get()
+            try:
+                real = realpath(path) if exists(path) else None
+            except (OSError, ValueError):
+                real = None
+            self._cache[path] = (time() + self.ttl, real)
+            with self._lock:
+                self._pending.discard(path)
+                done = not self._pending
+            if done and self.on_resolved is not None:
+                self.on_resolved()
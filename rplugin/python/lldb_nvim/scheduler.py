@@ -0,0 +1,86 @@
+# Queues calls to be made from the Controller thread.
+
+from __future__ import (absolute_import, division, print_function)
+
+from collections import deque
+from threading import Event, Lock
+
+__metaclass__ = type  # pylint: disable=invalid-name
+
+
+class EventLoopError(Exception):
+    pass
+
+
+class Task:
+    """ A call to be made from the event loop, which can be waited upon for its result. """
+
+    def __init__(self, method, args, key=None):
+        self.method = method
+        self.args = args
+        self.key = key  # set for tasks that can be coalesced
+        self.result = None
+        self._done = Event()
+
+    def finish(self, result=None):
+        self.result = result
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """ Returns the result of the call. Raises EventLoopError if the call did not complete
+            within timeout seconds.
+        """
+        if not self._done.wait(timeout):
+            raise EventLoopError("Timed out!")
+        return self.result
+
+
+class Scheduler:
+    """ (thread-safe) Unbounded FIFO queues of tasks: one for foreground tasks, and another
+        for background tasks, which are only handed out when no foreground task is queued.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._tasks = deque()
+        self._background_tasks = deque()
+        self._coalescable = {}  # maps key -> queued task with that key
+
+    def put(self, method, args, coalesce=False, background=False):
+        """ Queue a call to method with args, and return its Task. If coalesce is set, and an
+            identical call (same method and args) was queued with coalesce set and has not
+            started yet, no new call is queued, and the Task of the queued call is returned.
+        """
+        with self._lock:
+            key = None
+            if coalesce:
+                key = (method, repr(args), background)
+                if key in self._coalescable:
+                    return self._coalescable[key]
+                self._coalescable[key] = task = Task(method, args, key)
+            else:
+                task = Task(method, args)
+            if background:
+                self._background_tasks.append(task)
+            else:
+                self._tasks.append(task)
+            return task
+
+    def get(self):
+        """ Remove and return the oldest foreground Task, or if there is none, the oldest
+            background Task. Returns None if both queues are empty.
+        """
+        with self._lock:
+            if self._tasks:
+                task = self._tasks.popleft()
+            elif self._background_tasks:
+                task = self._background_tasks.popleft()
+            else:
+                return None
+            if task.key is not None:
+                del self._coalescable[task.key]
+            return task
+
+    def has_foreground(self):
+        """ Returns True if a foreground task is waiting. """
+        return len(self._tasks) > 0
@@ -29,10 +29,9 @@ class Session:  # pylint: disable=too-many-instance-attributes
         """ Sets the value of bp.id key by trying to resolve bp to a single location;
             if not possible, sets the value to fallback
         """
-        from .lldb_utils import get_bploc_tuples, settings_target_source_map
+        from .lldb_utils import get_bploc_tuples
         if bp.GetNumLocations() == 1:
-            self.bpid_map[bp.id] = get_bploc_tuples(
-                bp, settings_target_source_map(self.ctrl.get_command_result))[0]
+            self.bpid_map[bp.id] = get_bploc_tuples(bp, self.ctrl.get_source_map())[0]
         else:
             self.bpid_map[bp.id] = fallback
 
@@ -43,33 +42,28 @@ class Session:  # pylint: disable=too-many-instance-attributes
             for bp in target.breakpoint_iter():  # patch up
                 self.bp_map_auto(bp)
 
-    def bp_changed(self, cmd, bp_iter):  # pylint: disable=too-many-branches
+    def bp_changed(self, cmd, new_bps, del_bpids):
+        """ Maps breakpoints added by a command (None if not added by a command), and
+            forgets deleted ones.
+        """
         import re
-        old_bps = set(self.bpid_map.keys())
-        cur_bps = set()
-        bpid_llobj_map = {}
-        for bp in bp_iter:
-            cur_bps.add(bp.id)
-            bpid_llobj_map[bp.id] = bp
-
-        new_bps = cur_bps - old_bps
-        del_bps = old_bps - cur_bps
         if len(new_bps) == 1:
-            bpid = new_bps.pop()
-            bp = bpid_llobj_map[bpid]
-            if re.match(r'(b|tbreak|_regexp-t?break|) \S+:[0-9]+\s*$', cmd):
+            bp = new_bps[0]
+            if cmd is None:
+                self.bp_map_auto(bp)
+            elif re.match(r'(b|tbreak|_regexp-t?break|) \S+:[0-9]+\s*$', cmd):
                 self.bp_map_auto(bp, cmd)
             else:
-                self.bpid_map[bpid] = cmd
+                self.bpid_map[bp.id] = cmd
         elif len(new_bps) > 1:  # from loading a script file?
-            for bpid in new_bps:
-                self.bpid_map[bpid] = None
+            for bp in new_bps:
+                self.bpid_map[bp.id] = None
             self.logger.warn("Multiple new breakpoints!")
 
-        if len(del_bps) > 0:
-            for bpid in del_bps:
-                del self.bpid_map[bpid]
-            self.logger.info("Deleted breakpoints %s!", repr(list(del_bps)))
+        if len(del_bpids) > 0:
+            for bpid in del_bpids:
+                self.bpid_map.pop(bpid, None)
+            self.logger.info("Deleted breakpoints %s!", repr(del_bpids))
 
     def bp_set(self):
         if self.ctrl.target is None:
@@ -218,8 +212,9 @@ class Session:  # pylint: disable=too-many-instance-attributes
         self.state = state
         self.mode_setup(self.state["modes"].keys()[0])
 
-    def handle(self, cmd, *args):  # pylint: disable=too-many-return-statements,too-many-branches
+    def handle(self, cmd, *args):
         """ Handler for :LLsession commands. """
+        # pylint: disable=too-many-return-statements,too-many-branches,too-many-statements
         if cmd == 'new':
             if self.isalive() and self.vimx.eval("lldb#session#discard_prompt()") == 0:
                 self.vimx.log("Session left unchanged!", 0)
@@ -302,13 +297,7 @@ class Session:  # pylint: disable=too-many-instance-attributes
                 json_str = re.sub(r'\[\s*"(bp|ll|sh)",\s*"([^"]*)"\s*\]',
                                   r'[ "\1", "\2" ]', json_str)
                 json_str = re.sub(r'(\[|[0-9]+,?)\s+(?=\]|[0-9]+)', r'\1 ', json_str)
-
-                def json_show(b):
-                    if b.number == sfile_bufnr:
-                        b[:] = json_str.split('\n')
-                        raise StopIteration
-
-                self.vimx.map_buffers(json_show)
+                self.vimx.buffer_set_lines(sfile_bufnr, json_str.split('\n'))
                 if self.help_flags["new"] and self.help_flags["session_show"]:
                     self.vimx.log(
                         'Save this file, and do `:LLsession reload` to load any changes made.')
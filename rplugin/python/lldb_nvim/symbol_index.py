@@ -0,0 +1,147 @@
+# Indexes function and source file names of the target's modules, for completion.
+
+from __future__ import (absolute_import, division, print_function)
+
+from bisect import bisect_left
+from Queue import Queue
+from threading import Lock, Thread
+
+import lldb
+
+from .lldb_utils import get_module_key
+
+__metaclass__ = type  # pylint: disable=invalid-name
+
+
+class SymbolIndex(Thread):  # pylint: disable=too-many-instance-attributes
+    """ Thread that indexes the function names and source file names of modules, as they are
+        added, so that breakpoint specifications can be completed without searching symbol
+        tables. Names are looked up by prefix (in sorted lists), and then by substring.
+        The source file paths of each module added are passed to `on_sources`, if set.
+    """
+
+    def __init__(self, on_sources=None):
+        import logging
+        self.logger = logging.getLogger(__name__)
+
+        self.on_sources = on_sources
+        self._modules = Queue()
+        self._lock = Lock()
+        self._names = {}  # maps module key -> (set of function names, set of file names)
+        self._sorted = None  # (sorted function names, sorted file names) of all modules
+        self._executable = None  # the key of the module of the target's executable, if any
+
+        super(SymbolIndex, self).__init__()
+        self.daemon = True
+
+    def is_ready(self):
+        """ (thread-safe) Returns whether the module of the executable (or without one, any
+            module) was indexed, such that lookups find the user's own names.
+        """
+        with self._lock:
+            if self._executable is None:
+                return len(self._names) > 0
+            return self._executable in self._names
+
+    def set_executable(self, module):
+        """ (thread-safe) Set the module of the target's executable, if valid. """
+        with self._lock:
+            self._executable = get_module_key(module) if module.IsValid() else None
+
+    def add_module(self, module, source_map=None):
+        """ (thread-safe) Index a module in the background. Its source file paths are
+            mapped by source_map, if given.
+        """
+        if not self.is_alive():
+            self.start()
+        self._modules.put((module, True, source_map))
+
+    def remove_module(self, module):
+        """ (thread-safe) Forget the names of a module, once the ones queued are indexed. """
+        if self.is_alive():
+            self._modules.put((module, False, None))
+
+    def clear(self):
+        """ (thread-safe) Forget all modules, e.g. for a new target. """
+        with self._lock:
+            self._names = {}
+            self._sorted = None
+            self._executable = None
+
+    def run(self):
+        while True:
+            (module, add, source_map) = self._modules.get()
+            try:
+                key = get_module_key(module)
+                (names, sources) = self.get_module_names(module, source_map) if add else (None, [])
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception("Could not index module")
+                continue
+            if sources and self.on_sources is not None:
+                self.on_sources(sources)
+            with self._lock:
+                if names is None:
+                    self._names.pop(key, None)
+                else:
+                    self._names[key] = names
+                self._sorted = None
+
+    @staticmethod
+    def get_module_names(module, source_map=None):
+        """ Returns the sets of function names, and of source file names in a module, along
+            with the paths of its source files (mapped by source_map, if given).
+        """
+        functions = set()
+        for symbol in module:
+            if symbol.GetType() == lldb.eSymbolTypeCode:
+                name = symbol.GetName()
+                if name:
+                    # `b` takes C++ names without parameters
+                    paren = name.find('(')
+                    functions.add(name[:paren] if paren > 0 else name)
+        files = set()
+        sources = []
+        for i in range(module.GetNumCompileUnits()):
+            spec = module.GetCompileUnitAtIndex(i).GetFileSpec()
+            if spec.GetFilename():
+                files.add(spec.GetFilename())
+            path = spec.fullpath
+            if path:
+                sources.append(source_map.resolve(path) if source_map else path)
+        return ((functions, files), sources)
+
+    def get_sorted(self):
+        """ Returns the sorted function names, and file names of all modules. """
+        with self._lock:
+            if self._sorted is None:
+                functions = set()
+                files = set()
+                for (module_functions, module_files) in self._names.values():
+                    functions.update(module_functions)
+                    files.update(module_files)
+                self._sorted = (sorted(functions), sorted(files))
+            return self._sorted
+
+    @staticmethod
+    def match(names, text, limit):
+        """ Returns up to limit names starting with text, followed by the names containing
+            it elsewhere.
+        """
+        found = []
+        i = bisect_left(names, text)
+        while i < len(names) and len(found) < limit and names[i].startswith(text):
+            found.append(names[i])
+            i += 1
+        if text and len(found) < limit:
+            for name in names:
+                if text in name and not name.startswith(text):
+                    found.append(name)
+                    if len(found) >= limit:
+                        break
+        return found
+
+    def lookup_functions(self, text, limit=1000):
+        return self.match(self.get_sorted()[0], text, limit)
+
+    def lookup_files(self, text, limit=1000):
+        return self.match(self.get_sorted()[1], text, limit)
@@ -6,14 +6,14 @@
 
 from __future__ import (absolute_import, division, print_function)
 
-from os.path import exists as path_exists
 from . import lldb_utils as llu
+from .bp_index import BreakpointIndex
 from .vim_signs import BPSign, PCSign
 
 __metaclass__ = type  # pylint: disable=invalid-name
 
 
-class VimBuffers:  # pylint: disable=too-many-instance-attributes
+class VimBuffers:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     content_map = {
         "backtrace": "bt",
         "breakpoints": "breakpoint list",
@@ -23,6 +23,20 @@ class VimBuffers:  # pylint: disable=too-many-instance-attributes
         "registers": "register read"
     }
 
+    # Buffer commands rendered through the SB API (when the process is stopped), rather than
+    # by the command interpreter. These only compute what is shown: what fits in the windows
+    # showing them, or what the user expanded. Those keeping no state are in lldb_utils.
+    renderers = {
+        "bt": "format_backtrace",
+        "bt all": "format_backtrace_all",
+        "thread list": "format_threads",
+        "frame variable": "render_locals",
+        "disassemble -c 20 -p": "render_disassembly",
+        "register read": "render_registers",
+    }
+    DEFAULT_HEIGHT = 200  # lines rendered for buffers never shown in any window
+    LOCALS_PAGE = 32  # children of a variable shown per expansion
+
     def __init__(self, ctrl, vimx):
         """ Declare VimBuffers state variables """
         import logging
@@ -31,55 +45,130 @@ class VimBuffers:  # pylint: disable=too-many-instance-attributes
         self.logger = logging.getLogger(__name__)
 
         self.buf_map = {}
+        self.lazy_refresh = True
+        self.dirty = set()  # buffers that went stale while not being shown
+
+        self.logs_lines = 1  # an upper bound on the number of lines in the logs buffer
+        self.logs_max_lines = 0  # if positive, the oldest logs are trimmed beyond this
+        self.logs_spill_file = ''  # if set, trimmed logs are appended to this file
+
+        self.heights = {}  # maps buffer name -> height of the window that last showed it
+
+        self.instructions = llu.InstructionCache()
+
+        # Expandable tree of local variables
+        self.locals_expanded = {}  # maps path of an expanded variable -> children shown
+        self.locals_paths = []  # the (kind, path) of each line of the locals buffer
+
+        # Register sets, of which only the first (general purpose) one is expanded by default
+        self.registers_toggled = set()  # names of sets expanded/collapsed by the user
+        self.registers_sets = []  # the name of the set on each line of the registers buffer
+        self.registers_stop = None  # the (pid, stop id) of registers_values
+        self.registers_values = {}  # maps (thread, frame, set name) -> values, at registers_stop
+        self.registers_last = {}  # registers_values at the stop before registers_stop
+        self.registers_changed = []  # lines (0-based) of registers changed since that stop
+
+        # Buffer contents at the stop given by stop_key
+        self.stop_key = None
+        self.output_cache = {}  # maps command (or (command, height) if rendered) -> lines
 
         # Currently shown signs
-        self.bp_signs = {}  # maps (bufnr, line) -> <BPSign object>
-        self.bp_list = {}  # maps (bufnr, line) -> [<SBBreakpoint object>, ...]
+        self.bp_index = BreakpointIndex()
+        self.bp_signs = {}  # maps (path, line) -> <BPSign object>
+        self.bp_hidden = set()  # (path, line) of breakpoint signs hidden under a PC sign
+        self.shown_paths = None  # if signs are only placed on shown lines, [(path, first, last)]
+        self.shown_files = None  # and a map of their real paths -> [(first, last or None)]
+        self.shown_files_checked = False
+        self.bp_unresolved = set()  # ids of breakpoints at paths not resolved yet
+        self.pc_unresolved = False  # whether a PC location is at a path not resolved yet
         self.pc_signs = {}
         self.pc_cur_loc = None
 
     def buf_map_check(self):
         if not self.buf_map:
             self.buf_map = self.vimx.init_buffers()
+            (lazy_refresh, self.logs_max_lines, self.logs_spill_file) = self.vimx.eval(
+                "[get(g:, 'lldb#layout#lazy_refresh', 1), get(g:, 'lldb#logs#max_lines', 10000),"
+                " expand(get(g:, 'lldb#logs#spill_file', ''))]")
+            self.lazy_refresh = lazy_refresh != 0
 
-    def update_pc(self, target):  # pylint: disable=too-many-branches
-        """ Place the PC sign on the PC location of each thread's selected frame.
-            If the 'selected' PC location has changed, jump to it.
+    def pc_source_locs(self, process):
+        """ Returns a list of (path, line, is_selected) for the PC location of each thread's
+            selected frame, in existing files. If some files were not resolved yet, the PC
+            is marked unresolved.
         """
-
-        # Clear all existing PC signs
-        for sign in self.pc_signs.values():
-            sign.hide()
-        self.pc_signs = {}
-
-        if target is None or not target.IsValid():
-            return
-        process = target.GetProcess()
-        if process is None or not process.IsValid() or not process.is_alive:
-            return
-
-        # Show a PC marker for each thread
+        source_map = self.ctrl.get_source_map()
+        selected_id = process.GetSelectedThread().GetIndexID()
+        locs = []
         for thread in process:
-            loc = llu.get_pc_source_loc(thread, self.ctrl.get_command_result)
+            loc = llu.get_pc_source_loc(thread, source_map)
             if not loc:
-                # no valid source locations for PCs. hide all existing PC markers
                 continue
 
-            (_, fname, line) = loc
             self.logger.info("Got pc loc: %s", repr(loc))
-            is_selected = thread.GetIndexID() == process.GetSelectedThread().GetIndexID()
-            if path_exists(fname):
-                bufnr = self.vimx.buffer_add(fname)
-            else:
-                continue
+            (thread_id, fname, line) = loc
+            exists = self.ctrl.paths.exists(fname)
+            if exists is None:
+                self.pc_unresolved = True
+            elif exists:
+                locs.append((fname, line, thread_id == selected_id))
+        return locs
 
-            hidden = not is_selected and (bufnr, line) in self.pc_signs
-            sign = PCSign(self.vimx, bufnr, line, is_selected, hidden)
-            self.pc_signs[(bufnr, line)] = sign
+    def get_pc_locs(self, target):
+        """ Returns a dict that maps (bufnr, line) of the PC location of each thread's
+            selected frame, to whether the selected thread is there.
+        """
+        self.pc_unresolved = False
+        process = None
+        if target is not None and target.IsValid():
+            process = target.GetProcess()
+        if process is None or not process.IsValid() or not process.is_alive:
+            return {}
 
-            if is_selected and self.pc_cur_loc != (bufnr, line):
-                self.vimx.sign_jump(bufnr, sign.id)
-                self.pc_cur_loc = (bufnr, line)
+        pc_locs = {}
+        locs = self.pc_source_locs(process)
+        bufnrs = self.vimx.buffers_add([path for (path, _, _) in locs])
+        for (bufnr, (_, line, is_selected)) in zip(bufnrs, locs):
+            key = (bufnr, line)
+            pc_locs[key] = pc_locs.get(key, False) or is_selected
+        return pc_locs
+
+    def update_pc(self, target):
+        """ Place the PC sign on the PC location of each thread's selected frame.
+            Signs are only touched where PC locations changed, and their ids are reused.
+            If the 'selected' PC location has changed, jump to it.
+        """
+        with self.vimx.sign_batch():
+            pc_locs = self.get_pc_locs(target)
+
+            # Signs no longer at a PC location are moved to new locations, or hidden
+            stale = [k for k in self.pc_signs if k not in pc_locs]
+            for (key, selected) in pc_locs.items():
+                sign = self.pc_signs.get(key)
+                if sign is None:
+                    if stale:
+                        sign = self.pc_signs.pop(stale.pop())
+                        sign.move(*key)
+                    else:
+                        sign = PCSign(self.vimx, key[0], key[1], selected)
+                    self.pc_signs[key] = sign
+                if sign.selected != selected:
+                    sign.select(selected)
+
+                if selected and self.pc_cur_loc != key:
+                    self.vimx.sign_jump(key[0], sign.id)
+                    self.pc_cur_loc = key
+
+            for key in stale:
+                self.pc_signs.pop(key).hide()
+
+            # Breakpoint signs hidden under a PC sign are shown once the PC moved away
+            for loc in list(self.bp_hidden):
+                sign = self.bp_signs.get(loc)
+                if sign is None or (sign.bufnr, sign.line) not in pc_locs:
+                    self.bp_hidden.discard(loc)
+                    if sign is not None and sign.hidden:
+                        sign.show()
 
     def logs_append(self, outstr, prefix=None):
         """ Returns the number lines appended """
@@ -93,71 +182,400 @@ class VimBuffers:  # pylint: disable=too-many-instance-attributes
             if len(last_line) > 0:
                 last_line = prefix + last_line
             lines = [prefix + line for line in lines[:-1]] + [last_line]
-        self.vimx.update_noma_buffer(self.buf_map['logs'], lines, append=True)
-        self.vimx.buffer_scroll_bottom(self.buf_map['logs'])
+        self.vimx.buffer_append(self.buf_map['logs'], lines)
+        self.logs_lines += len(lines) - 1
+        if 0 < self.logs_max_lines < self.logs_lines:
+            self.logs_trim()
         return len(lines) - 1
 
-    def update_breakpoints(self, target, hard_update=False):  # pylint: disable=too-many-branches
-        """ Decorates buffer with signs corresponding to breakpoints in target. """
-
-        self.bp_list = {}
-        if target is None or not target.IsValid():
-            for (key, sign) in self.bp_signs.items():
-                if not sign.hidden:
-                    sign.hide()
+    def logs_trim(self):
+        """ If the logs buffer has more than logs_max_lines lines, drop the oldest ones in bulk,
+            leaving 3/4 of logs_max_lines. Dropped lines are spilled to logs_spill_file.
+        """
+        bufnr = self.buf_map['logs']
+        self.logs_lines = self.vimx.buffer_line_count(bufnr)  # logs may have been cleared
+        if self.logs_lines <= self.logs_max_lines:
             return
+        count = self.logs_lines - self.logs_max_lines * 3 // 4
 
-        needed_bps = set()
-        source_map = llu.settings_target_source_map(self.ctrl.get_command_result)
-        for bp in target.breakpoint_iter():
-            bplocs = llu.get_bploc_tuples(bp, source_map)
-            for (filepath, line) in bplocs:
-                if filepath and path_exists(filepath):
-                    bufnr = self.vimx.buffer_add(filepath)
-                    key = (bufnr, line)
-                    needed_bps.add(key)
-                    if key in self.bp_list:
-                        self.bp_list[key].append(bp)
-                    else:
-                        self.bp_list[key] = [bp]
-
-        # Hide all (outdated) breakpoint signs
-        new_bps = needed_bps
-        bp_signs = self.bp_signs.copy()
-        for (key, sign) in bp_signs.items():
-            if hard_update or key not in new_bps:
-                sign.hide()
-                del self.bp_signs[key]
-            else:
-                if bp_signs[key].hidden:
-                    bp_signs[key].show()
-                new_bps.discard(key)
+        if self.logs_spill_file:
+            lines = self.vimx.buffer_get_lines(bufnr, 0, count)
+            try:
+                with open(self.logs_spill_file, 'a') as f:
+                    for line in lines:
+                        f.write(line.encode('utf-8') if isinstance(line, unicode) else line)
+                        f.write('\n')
+            except IOError as e:
+                self.vimx.log('Could not spill logs: %s' % e)
+                self.logs_spill_file = ''
 
-        # Show all (new) breakpoint signs
-        for (bufnr, line) in new_bps:
-            self.bp_signs[(bufnr, line)] = BPSign(
-                self.vimx, bufnr, line, (bufnr, line) in self.pc_signs)
+        self.vimx.noma_buffer_delete(bufnr, 0, count)
+        self.logs_lines -= count
 
-    def update_buffer(self, buf, target):
-        self.buf_map_check()
+    def bp_source_locs(self, bp):
+        """ Returns the source locations (path, line) of a breakpoint, in existing files.
+            If some files were not resolved yet, the breakpoint is marked unresolved.
+        """
+        locs = []
+        for (path, line) in llu.get_bploc_tuples(bp, self.ctrl.get_source_map()):
+            if not path:
+                continue
+            (known, real) = self.ctrl.paths.lookup(path)
+            if not known:
+                self.bp_unresolved.add(bp.GetID())
+            elif real is not None:
+                locs.append((real, line))
+        return locs
+
+    def real_path(self, path):
+        """ Returns the real path of path, if resolved already, or else path itself (and
+            path is queued for resolution).
+        """
+        return self.ctrl.paths.lookup(path)[1] or path
+
+    def shown_files_check(self):
+        """ Reads g:lldb#sign#visible_only, and if set, which files are shown. """
+        if not self.shown_files_checked:
+            (visible_only, files) = self.vimx.eval(
+                "[get(g:, 'lldb#sign#visible_only', 0), lldb#layout#shown_files()]")
+            self.shown_paths = files if visible_only else None
+            self.shown_files = self.get_shown_files()
+            self.shown_files_checked = True
+
+    def get_shown_files(self):
+        """ Returns a dict that maps the real path of each shown file to the ranges of lines
+            (first, last or None for the end of the file) shown, in visible_only mode.
+        """
+        if self.shown_paths is None:
+            return None
+        shown = {}
+        for (path, first, last) in self.shown_paths:
+            shown.setdefault(self.real_path(path), []).append((first, last if last else None))
+        return shown
+
+    def is_shown(self, loc):
+        """ Returns whether a location (path, line) is shown, in visible_only mode. """
+        (path, line) = loc
+        return any(first <= line and (last is None or line <= last)
+                   for (first, last) in self.shown_files.get(path, []))
+
+    def get_shown_locs(self):
+        """ Returns the shown locations (path, line) with breakpoints. """
+        if self.shown_files is None:
+            return [(path, line) for path in self.bp_index.paths()
+                    for line in self.bp_index.lines(path)]
+        return [(path, line) for (path, ranges) in self.shown_files.items()
+                for (first, last) in ranges for line in self.bp_index.lines(path, first, last)]
 
+    def files_shown(self, files):
+        """ In visible_only mode, places the breakpoint signs of lines just shown in some
+            window, and removes those of lines no longer shown in any.
+            @param files
+                A list of (path, first line, last line, or 0 for the end of the file) shown
+                in each window.
+        """
+        self.shown_files_check()
+        if self.shown_paths is not None:
+            self.shown_paths = files
+            self.shown_files_sync()
+
+    def shown_files_sync(self):
+        """ Places the breakpoint signs of lines newly shown, and removes those of lines no
+            longer shown, since the real paths of shown files were last computed.
+        """
+        self.shown_files = self.get_shown_files()
+        with self.vimx.sign_batch():
+            for loc in [loc for loc in self.bp_signs if not self.is_shown(loc)]:
+                self.bp_signs.pop(loc).hide()
+            self.bp_signs_sync(self.get_shown_locs())
+
+    def update_unresolved(self, target):
+        """ Updates the signs which were left out, as their paths were not resolved yet. """
+        with self.vimx.sign_batch():
+            if self.pc_unresolved:
+                self.update_pc(target)
+            if self.shown_paths is not None:
+                self.shown_files_sync()
+            (bp_ids, self.bp_unresolved) = (self.bp_unresolved, set())
+            if target is not None and target.IsValid():
+                bps = [target.FindBreakpointByID(bp_id) for bp_id in bp_ids]
+                self.update_bp_signs([(bp, False) for bp in bps if bp.IsValid()])
+
+    def bp_signs_sync(self, locs):
+        """ Shows a sign at each of the given locations (path, line) with breakpoints, and
+            hides those at the others. In visible_only mode, signs are only shown on lines
+            shown in some window.
+        """
+        self.shown_files_check()
+        new_locs = []
+        for loc in set(locs):
+            sign = self.bp_signs.get(loc)
+            if loc not in self.bp_index:
+                if sign is not None:
+                    self.bp_signs.pop(loc).hide()
+            elif self.shown_files is not None and not self.is_shown(loc):
+                if sign is not None:
+                    self.bp_signs.pop(loc).hide()
+            elif sign is None:
+                new_locs.append(loc)
+            elif sign.hidden and loc not in self.bp_hidden:
+                sign.show()
+        bufnrs = self.vimx.buffers_add([path for (path, _) in new_locs])
+        for (bufnr, loc) in zip(bufnrs, new_locs):
+            hidden = (bufnr, loc[1]) in self.pc_signs
+            self.bp_signs[loc] = BPSign(self.vimx, bufnr, loc[1], hidden)
+            if hidden:
+                self.bp_hidden.add(loc)
+
+    def buffer_deleted(self, bufnr):
+        """ Forgets the signs of a deleted buffer, which were deleted along with it, and
+            places those of breakpoints again (in a new buffer).
+        """
+        self.vimx.buffer_forget(bufnr)
+        for key in [k for k in self.pc_signs if k[0] == bufnr]:
+            del self.pc_signs[key]
+        locs = [loc for (loc, sign) in self.bp_signs.items() if sign.bufnr == bufnr]
+        for loc in locs:
+            del self.bp_signs[loc]
+            self.bp_hidden.discard(loc)
+        if locs:
+            with self.vimx.sign_batch():
+                self.bp_signs_sync(locs)
+
+    def update_bp_signs(self, bp_changes):
+        """ Updates the index and signs for some (added, changed, or removed) breakpoints.
+            @param bp_changes
+                A list of tuples (breakpoint, whether it was removed).
+        """
+        changed = []
+        for (bp, removed) in bp_changes:
+            bp_id = bp.GetID()
+            changed += self.bp_index.remove(bp_id)
+            if not removed:
+                for (path, line) in self.bp_source_locs(bp):
+                    self.bp_index.add(bp_id, path, line)
+                    changed.append((path, line))
+        if changed:
+            with self.vimx.sign_batch():
+                self.bp_signs_sync(changed)
+
+    def update_breakpoints(self, target, hard_update=False):
+        """ Rebuilds the breakpoint index from target, and decorates buffers with signs
+            corresponding to its breakpoints.
+        """
+        with self.vimx.sign_batch():
+            self.bp_index.clear()
+            if target is not None and target.IsValid():
+                for bp in target.breakpoint_iter():
+                    for (path, line) in self.bp_source_locs(bp):
+                        self.bp_index.add(bp.GetID(), path, line)
+
+            # Hide all (outdated) breakpoint signs
+            for loc in list(self.bp_signs):
+                if hard_update or loc not in self.bp_index:
+                    self.bp_signs.pop(loc).hide()
+
+            self.shown_files_check()
+            self.bp_signs_sync(self.get_shown_locs())
+
+    def invalidate_cache(self):
+        """ Forget all cached command outputs. """
+        self.stop_key = None
+        self.output_cache = {}
+
+    def invalidate_buffer(self, buf):
+        """ Forget the cached content of a buffer. """
         command = self.content_map[buf]
-        proc_stat = llu.get_process_stat(target)[1]
-        success, output = self.ctrl.get_command_result(command)
-        if not success and proc_stat:
-            output = proc_stat
-        if output is None:
-            output = ''
-        results = output.split('\n')
+        for key in list(self.output_cache):
+            if key == command or isinstance(key, tuple) and key[0] == command:
+                del self.output_cache[key]
 
-        if buf == 'breakpoints':
-            self.update_breakpoints(target)
+    def get_buffer_output(self, buf, target, height=None):
+        """ Returns the lines to show in a buffer. Outputs are reused until the process stops
+            again, or the selected thread or frame changes.
+            @param height
+                The height of the window showing the buffer, if any.
+        """
+        command = self.content_map[buf]
+        renderer = self.renderers.get(command)
+        key = command if renderer is None else (command, height)
+        stop_key = llu.get_stop_key(target)
+        if stop_key is None or stop_key != self.stop_key:
+            self.invalidate_cache()
+            self.stop_key = stop_key
+        elif key in self.output_cache:
+            return self.output_cache[key]
+
+        (proc, proc_stat) = llu.get_process_stat(target)
+        if renderer is not None and stop_key is not None:
+            render = getattr(self, renderer, None) or getattr(llu, renderer)
+            lines = render(proc, height or self.DEFAULT_HEIGHT)
+        else:
+            success, output = self.ctrl.get_command_result(command)
+            if not success and proc_stat:
+                output = proc_stat
+            if output is None:
+                output = ''
+            lines = output.split('\n')
+            if buf == 'locals':  # these lines cannot be toggled
+                self.locals_paths = []
+            elif buf == 'registers':
+                self.registers_sets = []
+        # breakpoints may change without the process being resumed
+        if stop_key is not None and buf != 'breakpoints':
+            self.output_cache[key] = lines
+        return lines
+
+    def render_value(self, value, path, depth, lines):
+        """ Appends lines describing a variable, and its children if expanded, to lines. """
+        name = value.GetName()
+        path = path + (name,)
+        limit = self.locals_expanded.get(path)
+        if value.GetError().Fail():
+            expandable = False
+            desc = value.GetError().GetCString()
+        else:
+            expandable = value.MightHaveChildren()
+            desc = ' '.join([d for d in [value.GetValue(), value.GetSummary()] if d])
+            if not desc and expandable and not limit:
+                desc = '{...}'
+        marker = ' ' if not expandable else '-' if limit else '+'
+        lines.append('%s%s (%s) %s = %s' % ('  ' * depth, marker, value.GetTypeName(), name,
+                                            desc.replace('\n', '\\n')))
+        self.locals_paths.append(('var', path))
+
+        if expandable and limit:
+            num_children = value.GetNumChildren()
+            for i in range(min(num_children, limit)):
+                self.render_value(value.GetChildAtIndex(i), path, depth + 1, lines)
+            if num_children > limit:
+                lines.append('%s  ... (%d more)' % ('  ' * depth, num_children - limit))
+                self.locals_paths.append(('more', path))
+
+    def render_locals(self, process, _):
+        """ Renders `frame variable` as a tree, in which only expanded variables (see
+            toggle()) have their children fetched.
+        """
+        frame = process.GetSelectedThread().GetSelectedFrame()
+        lines = []
+        self.locals_paths = []
+        for value in frame.GetVariables(True, True, False, True):
+            self.render_value(value, (), 0, lines)
+        return lines
+
+    def render_disassembly(self, process, _):
+        """ Renders `disassemble -c 20 -p` from cached instructions, where possible. """
+        target = process.GetTarget()
+        pc = process.GetSelectedThread().GetSelectedFrame().GetPCAddress()
+        lines = llu.format_instructions(self.instructions.read(target, pc, 20),
+                                        pc.GetLoadAddress(target))
+        if not lines:
+            (_, output) = self.ctrl.get_command_result(self.content_map['disassembly'])
+            lines = output.split('\n') if output else []
+        return lines
+
+    def render_registers(self, process, _):
+        """ Renders `register read`, with all register sets but the first one collapsed (see
+            toggle()). Collapsed sets are not read. Registers whose values differ from those
+            in the same frame at the previous stop are listed in registers_changed.
+        """
+        stop_key = llu.get_stop_key(process.GetTarget())
+        if stop_key[:2] != self.registers_stop:  # a new stop, rather than another frame
+            self.registers_last = self.registers_values
+            self.registers_values = {}
+            self.registers_stop = stop_key[:2]
+
+        lines = []
+        self.registers_sets = []
+        self.registers_changed = []
+        frame = process.GetSelectedThread().GetSelectedFrame()
+        for (i, reg_set) in enumerate(frame.GetRegisters()):
+            name = reg_set.GetName()
+            expanded = (i == 0) != (name in self.registers_toggled)
+            if lines:
+                lines.append('')
+                self.registers_sets.append(None)
+            lines.append('%s %s:' % ('-' if expanded else '+', name))
+            self.registers_sets.append(name)
+            if not expanded:
+                continue
+
+            key = stop_key[2:] + (name,)
+            values = self.registers_values.get(key)
+            if values is None:
+                values = [reg.GetValue() or '' for reg in reg_set]
+                self.registers_values[key] = values
+            last = self.registers_last.get(key)
+            for (j, reg) in enumerate(reg_set):
+                if last is not None and j < len(last) and last[j] != values[j]:
+                    self.registers_changed.append(len(lines))
+                lines.append('%10s = %s' % (reg.GetName(), values[j]))
+                self.registers_sets.append(name)
+        return lines
+
+    def toggle(self, buf, line, target):
+        """ Expand or collapse the item at a line (1-based) of a buffer. """
+        if buf == 'locals' and 0 < line <= len(self.locals_paths):
+            (kind, path) = self.locals_paths[line - 1]
+            if kind == 'more':
+                self.locals_expanded[path] += self.LOCALS_PAGE
+            elif path in self.locals_expanded:
+                del self.locals_expanded[path]
+            else:
+                self.locals_expanded[path] = self.LOCALS_PAGE
+        elif buf == 'registers' and 0 < line <= len(self.registers_sets):
+            name = self.registers_sets[line - 1]
+            if name is None:
+                return
+            self.registers_toggled ^= set([name])
+        else:
+            return
+        self.invalidate_buffer(buf)
+        self.update_buffer(buf, target)
+
+    def update_buffer(self, buf, target, height=None):
+        self.buf_map_check()
+        self.dirty.discard(buf)
+        if height:
+            self.heights[buf] = height
+        else:
+            height = self.heights.get(buf)
+
+        results = self.get_buffer_output(buf, target, height)
 
         self.vimx.update_noma_buffer(self.buf_map[buf], results)
+        if buf == 'registers':
+            changed = self.registers_changed if llu.get_stop_key(target) is not None else []
+            self.vimx.buffer_highlight_lines(self.buf_map[buf], 'LLRegisterChanged', changed)
 
-    def update(self, target):
-        """ Updates signs, buffers, and possibly jumps to pc. """
-        self.update_pc(target)
+    def update(self, target, force=False):
+        """ Updates signs, buffers, and possibly jumps to pc.
+            In lazy refresh mode, buffers not shown in the current tab are only marked dirty,
+            unless `force` is set. If other calls are waiting in the event loop, the update
+            stops early, and is rescheduled to finish after them.
+        """
+        with self.vimx.sign_batch():
+            self.buf_map_check()
+            self.update_pc(target)
 
-        for buf in self.content_map:
-            self.update_buffer(buf, target)
+            heights = self.vimx.visible_buffers()
+            visible = self.content_map if force or not self.lazy_refresh else heights
+            preempted = False
+            for buf in self.content_map:
+                if buf in visible and not preempted:
+                    preempted = self.ctrl.should_yield()
+                if buf in visible and not preempted:
+                    self.update_buffer(buf, target, heights.get(buf))
+                else:
+                    self.dirty.add(buf)
+            if preempted:  # finish after the calls that preempted this update
+                self.ctrl.schedule_update(force)
+
+    def update_dirty(self, heights, target):
+        """ Updates those of the given buffers which were marked dirty.
+            @param heights
+                Maps buffer names to the heights of the windows showing them.
+        """
+        for (buf, height) in heights.items():
+            if buf in self.dirty:
+                self.update_buffer(buf, target, height)
@@ -35,6 +35,14 @@ class VimSign:
         self.vimx.sign_unplace(self.id)
         self.hidden = True
 
+    def move(self, bufnr, line):
+        """ Show the sign at another location, keeping its id. """
+        if not self.hidden and bufnr != self.bufnr:
+            self.hide()
+        self.bufnr = bufnr
+        self.line = line
+        self.show()
+
 
 class BPSign(VimSign):
 
@@ -51,3 +59,10 @@ class PCSign(VimSign):
         name = VimSign.SIGN_PC_SELECTED if selected else VimSign.SIGN_PC_UNSELECTED
         super(PCSign, self).__init__(vimx, name, bufnr, line, hidden)
     # pylint: enable=too-many-arguments
+
+    def select(self, selected):
+        """ Switch between the selected and unselected variants of the sign. """
+        self.selected = selected
+        self.name = VimSign.SIGN_PC_SELECTED if selected else VimSign.SIGN_PC_UNSELECTED
+        if not self.hidden:
+            self.show()
@@ -1,11 +1,12 @@
 from __future__ import (absolute_import, division, print_function)
 
+from contextlib import contextmanager
 from Queue import Queue
 
 __metaclass__ = type  # pylint: disable=invalid-name
 
 
-class VimX:
+class VimX:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
 
     def __init__(self, vim):
         self._vim = vim
@@ -16,6 +17,11 @@ class VimX:
             self._vim_test = False
         # pylint: enable=protected-access
         self.buffer_cache = {}
+        self.bufnr_cache = {}  # maps buffer name -> number, for buffers added by buffers_add()
+        self._sign_cmds = None  # sign commands gathered by sign_batch()
+        self._sign_batch_depth = 0
+        self.highlight_src = None  # the source id of highlights added by buffer_highlight_lines()
+        self.highlighted = set()  # buffers with such highlights
 
     def call(self, *args, **kwargs):
         vim = self._vim
@@ -30,6 +36,20 @@ class VimX:
                 return vim.call(*args, async=True)
             vim.async_call(lambda: vim.call(*args, async=True))
 
+    def request(self, name, *args, **kwargs):
+        """ Same as call(), but for Neovim API functions, like `nvim_buf_get_name`. """
+        vim = self._vim
+        if 'async' not in kwargs or not kwargs['async']:
+            if self._vim_test:
+                return vim.request(name, *args, async=False)
+            out_q = Queue()
+            vim.async_call(lambda: out_q.put(vim.request(name, *args, async=False)))
+            return out_q.get()
+        else:
+            if self._vim_test:
+                return vim.request(name, *args, async=True)
+            vim.async_call(lambda: vim.request(name, *args, async=True))
+
     def eval(self, expr, async=False):
         vim = self._vim
         if self._vim_test:
@@ -55,96 +75,187 @@ class VimX:
 
     def buffer_add(self, name):
         """ Create a buffer (if it doesn't exist) and return its number. """
-        bufnr = self.call('bufnr', name, 1)
-        self.call('setbufvar', bufnr, '&bl', 1, async=True)
-        return bufnr
+        return self.buffers_add([name])[0]
+
+    def buffers_add(self, names):
+        """ Create buffers (if they don't exist) and return their numbers.
+            Numbers are cached, so only names not seen before cost a (single) call.
+        """
+        # the cache is read only once, as buffer_forget() may be called from another thread
+        bufnrs = [self.bufnr_cache.get(n) for n in names]
+        unknown = list(set(n for (n, nr) in zip(names, bufnrs) if nr is None))
+        if unknown:
+            added = dict(zip(unknown, self.call('lldb#util#buffers_add', unknown)))
+            self.bufnr_cache.update(added)
+            bufnrs = [added[n] if nr is None else nr for (n, nr) in zip(names, bufnrs)]
+        return bufnrs
 
-    def buffer_scroll_bottom(self, bufnr):
-        """ Scroll to bottom for every window that displays the given buffer in the current tab """
-        self.call('lldb#util#buffer_do', bufnr, 'normal! G', async=True)
+    def buffer_forget(self, bufnr):
+        """ Drop everything cached about a buffer that was deleted. """
+        for (name, nr) in self.bufnr_cache.items():
+            if nr == bufnr:
+                del self.bufnr_cache[name]
+        self.buffer_cache.pop(bufnr, None)
+
+    def buffer_append(self, bufnr, lines):
+        """ Append lines to a buffer, joining the first one to its last line, without waiting.
+            Windows at the end of the buffer keep following it.
+        """
+        if lines:
+            self.call('lldb#util#buffer_append', bufnr, lines, async=True)
+
+    def visible_buffers(self):
+        """ Get a dict that maps names of lldb buffers shown in the current tab to the height
+            of the tallest window showing each.
+        """
+        return self.call('lldb#layout#visible_buffers')
+
+    @contextmanager
+    def sign_batch(self):
+        """ Gathers the sign commands issued within the block, and executes them all in a
+            single call when the (outermost) block exits.
+        """
+        if self._sign_batch_depth == 0:
+            self._sign_cmds = []
+        self._sign_batch_depth += 1
+        try:
+            yield
+        finally:
+            self._sign_batch_depth -= 1
+            if self._sign_batch_depth == 0:
+                cmds, self._sign_cmds = self._sign_cmds, None
+                if cmds:
+                    self.call('lldb#util#exec_all', cmds, async=True)
+
+    def sign_command(self, cmd):
+        """ Execute a sign command, or defer it until the end of the current sign batch. """
+        if self._sign_cmds is not None:
+            self._sign_cmds.append(cmd)
+        else:
+            self.command(cmd)
 
     def sign_jump(self, bufnr, sign_id):
         """ Try jumping to the specified sign_id in buffer with number bufnr. """
-        self.call('lldb#layout#signjump', bufnr, sign_id, async=True)
+        self.sign_command('call lldb#layout#signjump(%d, %d)' % (bufnr, sign_id))
 
     def sign_place(self, sign_id, name, bufnr, line):
         """ Place a sign at the specified location. """
         cmd = "sign place %d name=%s line=%d buffer=%s" % (sign_id, name, line, bufnr)
-        self.command(cmd)
+        self.sign_command(cmd)
 
     def sign_unplace(self, sign_id):
         """ Hide a sign with specified id. """
-        self.command("sign unplace %d" % sign_id)
-
-    def map_buffers(self, fn):
-        """ Does a map using fn callback on all buffer object and returns a list.
-            @param fn: callback function which takes buffer object as a parameter.
-                       If None is returned, the item is ignored.
-                       If a StopIteration is raised, the loop breaks.
-            @return: The last item in the list returned is a placeholder indicating:
-                     * completed iteration, if None is present
-                     * otherwise, if StopIteration was raised, the message would be the last item
+        self.sign_command("sign unplace %d" % sign_id)
+
+    def buffer_set_lines(self, bufnr, lines, start=0, end=-1):
+        """ Replace lines [start, end) of a buffer; the whole buffer by default. """
+        self.request('nvim_buf_set_lines', bufnr, start, end, False, lines, async=True)
+
+    def buffer_line_count(self, bufnr):
+        return self.request('nvim_buf_line_count', bufnr)
+
+    def buffer_get_lines(self, bufnr, start=0, end=-1):
+        """ Get lines [start, end) of a buffer; the whole buffer by default. """
+        return self.request('nvim_buf_get_lines', bufnr, start, end, False)
+
+    def buffer_highlight_lines(self, bufnr, group, lines):
+        """ Highlight lines (0-based) of a buffer, replacing the highlights previously added
+            to it this way.
         """
+        if not lines and bufnr not in self.highlighted:
+            return
         vim = self._vim
-        out_q = Queue(maxsize=1)
-
-        def map_buffers_inner():
-            mapped = []
-            breaked = False
-            for b in vim.buffers:
-                try:
-                    ret = fn(b)
-                    if ret is not None:
-                        mapped.append(ret)
-                except StopIteration as e:
-                    mapped.append(e.message)
-                    breaked = True
-                    break
-            if not breaked:
-                mapped.append(None)
-            out_q.put(mapped)
+
+        def highlight_inner():
+            if self.highlight_src is None:  # allocate a source id
+                self.highlight_src = vim.request('nvim_buf_add_highlight', bufnr, 0, '', 0, 0, 0)
+            src = self.highlight_src
+            calls = [['nvim_buf_clear_highlight', [bufnr, src, 0, -1]]]
+            calls.extend([['nvim_buf_add_highlight', [bufnr, src, group, line, 0, -1]]
+                          for line in lines])
+            vim.request('nvim_call_atomic', calls)
+        if lines:
+            self.highlighted.add(bufnr)
+        else:
+            self.highlighted.discard(bufnr)
         if self._vim_test:
-            map_buffers_inner()
+            highlight_inner()
         else:
-            vim.async_call(map_buffers_inner)
-        return out_q.get()
+            vim.async_call(highlight_inner)
 
-    def get_buffer_name(self, nr):
-        """ Get the buffer name given its number. """
-        def name_mapper(b):
-            if b.number == nr:
-                raise StopIteration(b.name)
-        return self.map_buffers(name_mapper)[0]
+    def noma_buffer_delete(self, bufnr, start, end):
+        """ Delete lines [start, end) of a nomodifiable buffer. """
+        self.request('nvim_call_atomic', [
+            ['nvim_buf_set_option', [bufnr, 'modifiable', True]],
+            ['nvim_buf_set_lines', [bufnr, start, end, False, []]],
+            ['nvim_buf_set_option', [bufnr, 'modifiable', False]]
+        ], async=True)
 
     def init_buffers(self):
         """ Create all lldb buffers and initialize the buffer map. """
         buf_map = self.call('lldb#layout#init_buffers')
         return buf_map
 
-    def update_noma_buffer(self, bufnr, content, append=False):  # noma => nomodifiable
-
-        def update_mapper(b):
-            if b.number == bufnr:
-                b.options['ma'] = True
-                if append:
-                    b[-1] += content[0]
-                    b[:] += content[1:]
-                else:
-                    b[:] = content
-                b.options['ma'] = False
-                raise StopIteration
-
-        has_mod = True
-        if append:
-            if len(content) == 0:
-                return
-        elif bufnr in self.buffer_cache \
-                and len(content) == len(self.buffer_cache[bufnr]):
-            has_mod = False
-            for l1, l2 in zip(content, self.buffer_cache[bufnr]):
-                if l1 != l2:
-                    has_mod = True
-                    break
-
-        if has_mod:
-            self.map_buffers(update_mapper)
+    def update_noma_buffer(self, bufnr, content):  # noma => nomodifiable
+        """ Replace the lines of a buffer with content. Only the line ranges that differ from
+            the last content are replaced.
+        """
+        content = content if content else ['']  # a buffer has at least one line
+        old = self.buffer_cache.get(bufnr)
+        # the buffer may have been unloaded (and emptied) since
+        if old is not None and self.buffer_line_count(bufnr) == len(old):
+            hunks = diff_lines(old, content)
+        else:
+            hunks = [(0, -1, content)]
+        self.buffer_cache[bufnr] = list(content)
+        if not hunks:
+            return
+
+        calls = [['nvim_buf_set_option', [bufnr, 'modifiable', True]]]
+        for (start, end, lines) in hunks:
+            calls.append(['nvim_buf_set_lines', [bufnr, start, end, True, lines]])
+        calls.append(['nvim_buf_set_option', [bufnr, 'modifiable', False]])
+
+        vim = self._vim
+
+        def update_inner():
+            vim.request('nvim_call_atomic', calls)
+        if self._vim_test:
+            update_inner()
+        else:
+            vim.async_call(update_inner)
+
+
+def common_ends(old, new):
+    """ Returns the numbers (head, tail) of lines that old and new have in common at their
+        beginnings and ends, such that head + tail does not exceed the length of either.
+    """
+    common = min(len(old), len(new))
+    head = 0
+    while head < common and old[head] == new[head]:
+        head += 1
+    tail = 0
+    while tail < common - head and old[-1 - tail] == new[-1 - tail]:
+        tail += 1
+    return (head, tail)
+
+
+def diff_lines(old, new, max_cost=1 << 18):
+    """ Returns a list of hunks (start, end, lines), such that replacing old[start:end] with
+        lines for each hunk, in the given order, turns old into new. Lines common to both
+        ends are trimmed first; the rest is matched line by line, unless that would cost more
+        than max_cost, in which case a single hunk is returned.
+    """
+    from difflib import SequenceMatcher
+    (head, tail) = common_ends(old, new)
+    old_mid = old[head:len(old) - tail]
+    new_mid = new[head:len(new) - tail]
+    if not old_mid and not new_mid:
+        return []
+    if len(old_mid) * len(new_mid) > max_cost:
+        return [(head, len(old) - tail, new_mid)]
+
+    matcher = SequenceMatcher(None, old_mid, new_mid, autojunk=False)
+    hunks = [(head + i1, head + i2, new_mid[j1:j2])
+             for (tag, i1, i2, j1, j2) in matcher.get_opcodes() if tag != 'equal']
+    return hunks[::-1]  # bottom-up, so that earlier hunks don't shift later ones
@@ -33,12 +33,16 @@ elseif name == 'breakpoints'
   hi def link LLBpLine Statement
   hi def link LLBpLocLine Comment
 elseif name == 'locals'
-  syn match LLVarType /^(\zs.\+\ze)/ contained
-  syn match LLVarIdent /) \zs\i\+\ze = /
-  syn match LLVarLine /^([^=]\+\i\+ = .*/ contains=LLVarType,LLVarIdent
+  syn match LLVarMarker /^ *\zs[-+]\ze (/ contained
+  syn match LLVarType /^ *[-+]\? *(\zs.\+\ze)/ contained
+  syn match LLVarIdent /) \zs[^ =]\+\ze = /
+  syn match LLVarLine /^ *[-+]\? *([^=]\+) [^ =]\+ = .*/ contains=LLVarMarker,LLVarType,LLVarIdent
+  syn match LLVarMore /^ *\.\.\. ([0-9]\+ more)$/
 
+  hi def link LLVarMarker Special
   hi def link LLVarType Type
   hi def link LLVarIdent Identifier
+  hi def link LLVarMore Comment
 elseif name == 'threads'
   syn match LLThreadNumber /thread \zs#[0-9]\+/ contained
   syn match LLThreadParams /[:,] [a-z ]\+ = \zs[^,]\+/ contained